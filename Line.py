@@ -1,3 +1,5 @@
+import numpy as np
+import numpy.typing as npt
 from numpy import power, sqrt
 from skimage.draw import line
 
@@ -121,10 +123,165 @@ class Line:
         """
         return sqrt(power(self.x2 - self.x1, 2) + power(self.y2 - self.y1, 2))
 
+    def scaled(self, factor: float, image_height: int = IMAGE_HEIGHT) -> "Line":
+        """A copy of the line with every coordinate multiplied by `factor`, e.g. to map a line found in a resized image back to the original.
+
+        ### Parameters
+        - factor (float): the factor to multiply the coordinates by
+        - image_height (int, optional): the height of the image the new line is in. Defaults to IMAGE_HEIGHT.
+
+        ### Returns
+        - Line: the scaled line
+        """
+        return Line(
+            self.x1 * factor, self.y1 * factor, self.x2 * factor, self.y2 * factor, image_height=image_height
+        )
+
     def __str__(self) -> str:
         """The string representation of the line.
 
         ### Returns
         - str: "p1: (x1, y1), p2: (x2, y2), slope: m, x-intercept: x, y-intercept: b"
         """
-        return f"p1: ({self.x1}, {self.y1}), p2: ({self.x2}, {self.y2}), slope: {self.slope:.2f}, x-intercept: {self.x_intercept}, y-intercept: {self.y_intercept}"
\ No newline at end of file
+        return f"p1: ({self.x1}, {self.y1}), p2: ({self.x2}, {self.y2}), slope: {self.slope:.2f}, x-intercept: {self.x_intercept}, y-intercept: {self.y_intercept}"
+
+
+class LineSet:
+    """Represents a set of line segments backed by a single (N, 4) array of [x1, y1, x2, y2] rows. The slope, x-intercept, y-intercept and length of every segment are computed at once, using the same conventions as `Line`.
+    """
+    def __init__(self, points: npt.ArrayLike, image_height: int = IMAGE_HEIGHT):
+        """Constructs a LineSet from an array of points.
+
+        ### Parameters
+        - points (npt.ArrayLike): anything reshapeable to (N, 4), e.g. the output of `cv2.HoughLinesP`
+        - image_height (int, optional): the height of the image, used for the x-intercepts. Defaults to IMAGE_HEIGHT.
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 4)
+        self.image_height = image_height
+        self.slope = self.calculate_slope()
+        self.x_intercept = self.calculate_x_intercept()
+        self.y_intercept = self.y(0)
+
+    @classmethod
+    def from_lines(cls, lines: list[Line], image_height: int = IMAGE_HEIGHT) -> "LineSet":
+        """Constructs a LineSet from a list of Line objects.
+
+        ### Parameters
+        - lines (list[Line]): the lines to pack
+        - image_height (int, optional): the height of the image. Defaults to IMAGE_HEIGHT.
+
+        ### Returns
+        - LineSet: the packed lines
+        """
+        return cls([line.get_points() for line in lines], image_height=image_height)
+
+    @property
+    def x1(self) -> npt.NDArray[np.float64]:
+        return self.points[:, 0]
+
+    @property
+    def y1(self) -> npt.NDArray[np.float64]:
+        return self.points[:, 1]
+
+    @property
+    def x2(self) -> npt.NDArray[np.float64]:
+        return self.points[:, 2]
+
+    @property
+    def y2(self) -> npt.NDArray[np.float64]:
+        return self.points[:, 3]
+
+    def calculate_slope(self) -> npt.NDArray[np.float64]:
+        """Calculates the slope of every line, see `Line.calculate_slope`.
+
+        ### Returns
+        - npt.NDArray[np.float64]: the slopes
+        """
+        dx = self.x2 - self.x1
+        dy = self.y2 - self.y1
+        slope = np.full(len(self), HORIZONTAL_SLOPE)
+        np.divide(dy, dx, out=slope, where=(dx != 0) & (dy != 0))
+        slope[dx == 0] = VERTICAL_SLOPE
+        return slope
+
+    def calculate_x_intercept(self) -> npt.NDArray[np.float64]:
+        """Calculates the intercept of every line with the bottom of the image, see `Line.calculate_x_intercept`.
+
+        ### Returns
+        - npt.NDArray[np.float64]: the x-intercepts
+        """
+        x_intercept = np.round(((self.image_height - self.y1) / self.slope) + self.x1)
+        x_intercept[self.y1 == self.y2] = NO_X_INTERCEPT
+        return x_intercept
+
+    def get_points(self) -> npt.NDArray[np.float64]:
+        """Returns the points of the lines.
+
+        ### Returns
+        - npt.NDArray[np.float64]: (N, 4) array of [x1, y1, x2, y2]
+        """
+        return self.points
+
+    def y(self, x: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        """Returns the y-coordinate on each line, given x. See `Line.y`.
+
+        ### Parameters
+        - x (npt.ArrayLike): the x-coordinate, either a scalar or one value per line
+
+        ### Returns
+        - npt.NDArray[np.float64]: the y-coordinates
+        """
+        return self.slope * (x - self.x1) + self.y1
+
+    def x(self, y: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        """Returns the x-coordinate on each line, given y. See `Line.x`.
+
+        ### Parameters
+        - y (npt.ArrayLike): the y-coordinate, either a scalar or one value per line
+
+        ### Returns
+        - npt.NDArray[np.float64]: the x-coordinates
+        """
+        return ((y - self.y1) / self.slope) + self.x1
+
+    def length(self) -> npt.NDArray[np.float64]:
+        """The length of every line.
+
+        ### Returns
+        - npt.NDArray[np.float64]: the lengths
+        """
+        return np.hypot(self.x2 - self.x1, self.y2 - self.y1)
+
+    def line(self, index: int) -> Line:
+        """A `Line` view of a single row, for code that still expects Line objects.
+
+        ### Parameters
+        - index (int): the row to view
+
+        ### Returns
+        - Line: the line at `index`
+        """
+        return Line(*self.points[index], image_height=self.image_height)
+
+    def to_lines(self) -> list[Line]:
+        """Unpacks the set into a list of Line objects.
+
+        ### Returns
+        - list[Line]: one Line per row
+        """
+        return [self.line(i) for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return self.points.shape[0]
+
+    def __getitem__(self, index):
+        """Integer indices return a `Line`; slices, masks and index arrays return a new LineSet."""
+        if isinstance(index, (int, np.integer)):
+            return self.line(index)
+        return LineSet(self.points[index], image_height=self.image_height)
+
+    def __iter__(self):
+        return (self.line(i) for i in range(len(self)))
+
+    def __str__(self) -> str:
+        return "\n".join(str(line) for line in self)
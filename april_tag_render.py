@@ -1,64 +1,259 @@
-import numpy as np
-from dt_apriltags import Detector
-import matplotlib.pyplot as plt
+import argparse
+import os
+import queue
+import threading
+import time
+
 import cv2
 import april_tags
-import time
+import latency
 from pid import *
+from tag_tracking import *
 
-cameraMatrix = np.array([ 1060.71, 0, 960, 0, 1060.71, 540, 0, 0, 1]).reshape((3,3))
 
-camera_params = ( cameraMatrix[0,0], cameraMatrix[1,1], cameraMatrix[0,2], cameraMatrix[1,2] )
+def annotate_frame(frame, tags, pids: PIDBank):
+    """Draws the tags and the PID outputs they give onto a frame. The PIDs keep state between frames, so frames must be annotated in order.
 
-at_detector = Detector(families='tag36h11',
-                       nthreads=1,
-                       quad_decimate=1.0,
-                       quad_sigma=0.0,
-                       refine_edges=1,
-                       decode_sharpening=0.25,
-                       debug=0)
+    Args:
+        frame: the frame the tags were found in, in BGR
+        tags (list): the tags found in the frame
+        pids (PIDBank): the PIDs of each tag, made by april_tags.tag_pids
 
-if __name__ == "__main__":
-    # The video writer
-    cap = cv2.VideoCapture("April_Tag_Test.mkv")
-    ret, frame1 = cap.read()
+    Returns:
+        image: the frame with the tags and outputs drawn onto it
+    """
+    if len(tags) > 0:
+        positions = april_tags.get_positions(tags)
+        errors = april_tags.error_relative_to_center(positions, frame.shape[0], frame.shape[1])
+        outputs = april_tags.output_from_tags(errors, pids)
+        frame = april_tags.render_tags(tags, frame)
+        frame = april_tags.draw_outputs(frame, outputs, tags)
+    return frame
 
-    height, width, layers = frame1.shape
-    size = (width, height)
 
-    out = cv2.VideoWriter("april_tag_render.mp4", cv2.VideoWriter_fourcc(*"mp4v"), 30, size)
+class StageTimes:
+    """Thread safe totals of the frames handled and the time spent by each stage of a pipeline."""
 
-    count = 0  # the amount of frames that have been read
-    # create PID objects, no idea what the right values are
-    horizontal_pid = PID(0.1, 0, 0, 100)
-    vertical_pid = PID(0.1, 0, 0, 100)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = {}
+        self.seconds = {}
+
+    def add(self, stage: str, seconds: float, frames: int = 1):
+        """Adds the time spent on some frames to a stage.
+
+        Args:
+            stage (str): the name of the stage
+            seconds (float): the time spent, in seconds
+            frames (int, optional): the number of frames handled in that time
+        """
+        with self._lock:
+            self.frames[stage] = self.frames.get(stage, 0) + frames
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def report(self, workers: dict = None) -> dict:
+        """The throughput of each stage, counting only the time it was busy.
 
-    # Video reading loop
-    while ret:
+        Args:
+            workers (dict, optional): the number of workers sharing each stage, to get the throughput of the whole stage rather than of one worker
+
+        Returns:
+            dict: the frames per second of each stage
+        """
+        if workers is None:
+            workers = {}
+        with self._lock:
+            return {
+                stage: workers.get(stage, 1) * self.frames[stage] / self.seconds[stage]
+                for stage in self.frames
+                if self.seconds[stage] > 0
+            }
+
+
+def decode_frames(cap, frames: queue.Queue, workers: int, times: StageTimes, first=None):
+    """Decodes every remaining frame of `cap` and queues them as (index, frame), then tells each of the `workers` to stop.
+
+    Args:
+        cap (cv2.VideoCapture): the video to read
+        frames (queue.Queue): the bounded queue of frames to detect tags in
+        workers (int): the number of workers reading from `frames`
+        times (StageTimes): where the time spent decoding is added
+        first (optional): a frame already read from `cap`, queued first
+    """
+    index = 0
+    if first is not None:
+        frames.put((index, first))
+        index += 1
+    while True:
+        start = time.perf_counter()
         ret, frame = cap.read()
         if not ret:
             break
+        times.add("decode", time.perf_counter() - start)
+        frames.put((index, frame))
+        index += 1
+    for _ in range(workers):
+        frames.put(None)
+
+
+def detect_worker(
+    frames: queue.Queue,
+    detected: queue.Queue,
+    times: StageTimes,
+    errors: list,
+    pool: DetectorPool,
+    track: bool = False,
+    adaptive: bool = False,
+):
+    """The loop run by each detection thread of `render_tag_video`. Finds the tags in (index, frame) tasks and queues them as (index, frame, tags) until it receives None.
+
+    Args:
+        frames (queue.Queue): the frames to detect tags in
+        detected (queue.Queue): where (index, frame, tags) are put, followed by None when done
+        times (StageTimes): where the time spent converting and detecting is added
+        errors (list): where an exception raised by the worker is put
+        pool (DetectorPool): the pool this worker borrows its Detector from
+        track (bool, optional): whether to follow tags with a TagTracker. It follows them from the last frame this worker saw.
+        adaptive (bool, optional): whether to pick quad_decimate and nthreads with a DetectorScheduler
+    """
+    scheduler = DetectorScheduler() if adaptive else None
+    tracker = TagTracker(pool, scheduler=scheduler) if track else None
+    try:
+        while True:
+            task = frames.get()
+            if task is None:
+                break
+            index, frame = task
+            start = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if tracker is not None:
+                tags = tracker.update(gray)
+            elif scheduler is not None:
+                tags = scheduler.detect(gray, pool)
+            else:
+                tags = get_tags(gray, pool)
+            times.add("detect", time.perf_counter() - start)
+            detected.put((index, frame, tags))
+    except BaseException as error:
+        errors.append(error)
+    finally:
+        detected.put(None)
 
-        print(f"now on frame {count}...")
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+def render_tag_video(
+    input: str,
+    output: str,
+    workers: int = None,
+    track: bool = False,
+    adaptive: bool = False,
+    report_every: int = 100,
+) -> dict:
+    """Renders the tags and PID outputs onto every frame of a video, as a pipeline of stages joined by bounded queues.
 
-        tags = at_detector.detect(
-            gray, estimate_tag_pose=True, camera_params=camera_params, tag_size=True
+    One thread decodes frames, `workers` threads find the tags in them, each with its own Detector, and the calling thread annotates and writes the frames in their original order. Detection and color conversion run in native code that releases the GIL, so the detection threads run in parallel.
+
+    Args:
+        input (str): the path of the video to render
+        output (str): the path to write the rendered video to
+        workers (int, optional): the number of detection threads. Defaults to the number of CPUs.
+        track (bool, optional): whether each detection thread follows tags with a TagTracker
+        adaptive (bool, optional): whether each detection thread picks quad_decimate and nthreads with a DetectorScheduler
+        report_every (int, optional): how often, in frames, to print the frame rate
+
+    Returns:
+        dict: the frames per second of the decode, detect, annotate and write stages, and of the whole pipeline as "total"
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    cap = cv2.VideoCapture(input)
+    ret, first = cap.read()
+    if not ret:
+        raise ValueError(f"could not read a frame from {input}")
+    height, width = first.shape[:2]
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    out = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    # create PID objects, no idea what the right values are
+    pids = april_tags.tag_pids(0.1, 0, 0, 100)
+
+    # the bounded queues limit how many frames are in memory at once
+    frames = queue.Queue(maxsize=2 * workers)
+    detected = queue.Queue(maxsize=2 * workers)
+    times = StageTimes()
+    errors = []
+    pool = DetectorPool(max_idle=workers)
+
+    threads = [
+        threading.Thread(
+            target=detect_worker,
+            args=(frames, detected, times, errors, pool, track, adaptive),
+            daemon=True,
         )
+        for _ in range(workers)
+    ]
+    threads.append(
+        threading.Thread(target=decode_frames, args=(cap, frames, workers, times, first), daemon=True)
+    )
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    pending = {}  # frames that were detected before the frames ahead of them
+    written = 0
+    finished = 0
+    try:
+        while finished < workers:
+            result = detected.get()
+            if result is None:
+                finished += 1
+                if errors:
+                    raise RuntimeError("a detection worker failed") from errors[0]
+                continue
+
+            index, frame, tags = result
+            pending[index] = (frame, tags)
+            while written in pending:
+                frame, tags = pending.pop(written)
+                stage_start = time.perf_counter()
+                frame = annotate_frame(frame, tags, pids)
+                times.add("annotate", time.perf_counter() - stage_start)
+                stage_start = time.perf_counter()
+                out.write(frame)
+                times.add("write", time.perf_counter() - stage_start)
+                written += 1
+                if written % report_every == 0:
+                    print(f"rendered {written} frames, {written / (time.perf_counter() - start):.1f} frames/sec")
+
+        for thread in threads:
+            thread.join()
+    finally:
+        cap.release()
+        out.release()
+        pool.close()
+
+    report = times.report({"detect": workers})
+    report["total"] = written / (time.perf_counter() - start)
+    print(f"Finished rendering the video: {written} frames, {report['total']:.1f} frames/sec.")
+    for stage in ("decode", "detect", "annotate", "write"):
+        if stage in report:
+            print(f"  {stage}: {report[stage]:.1f} frames/sec")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the AprilTags and PID outputs onto a video")
+    parser.add_argument("--input", type=str, default="April_Tag_Test.mkv", help="the video to render")
+    parser.add_argument("--output", type=str, default="april_tag_render.mp4", help="where to write the rendered video")
+    parser.add_argument("--workers", type=int, default=None, help="the number of detection threads, defaults to the number of CPUs")
+    parser.add_argument("--track", action="store_true", help="follow tags from frame to frame instead of searching whole frames")
+    parser.add_argument("--adaptive", action="store_true", help="pick the detector decimation and threads from recent frames")
+    parser.add_argument("--trace", type=str, default=None, help="record the latency of each stage, and write it to this JSON lines file")
+    args = parser.parse_args()
 
-        if len(tags) > 0:
-            positions = april_tags.get_positions(tags)
-            errors = april_tags.error_relative_to_center(
-                positions, frame.shape[0], frame.shape[1]
-            )
-            outputs = april_tags.output_from_tags(errors, horizontal_pid, vertical_pid)
-            frame = april_tags.render_tags(tags, frame)
-            frame = april_tags.draw_outputs(frame, outputs, tags)
-
-        out.write(frame)
-        count += 1
-
-    cap.release()
-    out.release()
-    print("Finished rendering the video.")
\ No newline at end of file
+    if args.trace:
+        recorder = latency.enable()
+    render_tag_video(args.input, args.output, workers=args.workers, track=args.track, adaptive=args.adaptive)
+    if args.trace:
+        recorder.write_trace(args.trace)
+        print(recorder.report())
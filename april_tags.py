@@ -1,39 +1,326 @@
+import atexit
+from collections import deque
+from contextlib import contextmanager
+import os
+import threading
+import time
 from dt_apriltags import Detector
 import numpy as np
 import cv2
+import latency
 from pid import *
 
-def get_tags(img) -> list:
+# CONSTANTS
+CAMERA_MATRIX = np.array([1060.71, 0, 960, 0, 1060.71, 540, 0, 0, 1]).reshape((3, 3))
+CAMERA_PARAMS = (
+    CAMERA_MATRIX[0, 0],
+    CAMERA_MATRIX[1, 1],
+    CAMERA_MATRIX[0, 2],
+    CAMERA_MATRIX[1, 2],
+)
+DETECTOR_CONFIG = {
+    "families": "tag36h11",
+    "nthreads": 1,
+    "quad_decimate": 1.0,
+    "quad_sigma": 0.0,
+    "refine_edges": 1,
+    "decode_sharpening": 0.25,
+    "debug": 0,
+}
+TAG_IDS = 587  # the number of tags in the tag36h11 family
+
+
+def free_detector(detector: Detector):
+    """Frees the native memory of a Detector. It must not be used afterwards.
+
+    Detector.__del__ frees the tag families before the detector, but freeing the detector still reads them, which can corrupt the heap. This frees them in the right order, and leaves nothing for __del__ to free.
+
+    Args:
+        detector (Detector): the Detector to free
+    """
+    if detector.tag_detector_ptr is None:
+        return
+    detector.libc.apriltag_detector_destroy.restype = None
+    detector.libc.apriltag_detector_destroy(detector.tag_detector_ptr)
+    detector.tag_detector_ptr = None
+    for family, tag_family in detector.tag_families.items():
+        destroy = getattr(detector.libc, f"{family}_destroy")
+        destroy.restype = None
+        destroy(tag_family)
+    detector.tag_families = {}
+
+
+class DetectorPool:
+    """A thread safe cache of Detectors, kept per configuration.
+
+    Building a Detector allocates the native detector and its tag family tables, which costs more than detecting tags in a small frame. The pool keeps idle Detectors around instead, and hands each caller its own instance, since one Detector must not be used by two threads at once.
+
+    Attributes:
+        max_idle (int): the most idle Detectors kept for each configuration
+        created (int): the number of Detectors the pool has built
+    """
+
+    def __init__(self, max_idle=4):
+        """Constructs an empty DetectorPool.
+
+        Args:
+            max_idle (int, optional): the most idle Detectors kept for each configuration. Extra Detectors are freed when released.
+        """
+        self.max_idle = max_idle
+        self.created = 0
+        self._lock = threading.Lock()
+        self._idle = {}  # config key -> list of idle Detectors
+        self._generation = {}  # config key -> number of times it was evicted
+        self._in_use = {}  # id(Detector) -> (config key, generation)
+
+    @staticmethod
+    def config_key(**config) -> tuple:
+        """The key a configuration is cached under, with the defaults from DETECTOR_CONFIG filled in.
+
+        Args:
+            **config: Detector arguments, e.g. families or quad_decimate
+
+        Returns:
+            tuple: the sorted (argument, value) pairs
+        """
+        unknown = set(config) - set(DETECTOR_CONFIG)
+        if unknown:
+            raise TypeError(f"unknown Detector arguments: {sorted(unknown)}")
+        return tuple(sorted({**DETECTOR_CONFIG, **config}.items()))
+
+    def acquire(self, **config) -> Detector:
+        """Takes an idle Detector for a configuration, or builds one if there is none. It must be given back with `release`.
+
+        Args:
+            **config: Detector arguments that differ from DETECTOR_CONFIG
+
+        Returns:
+            Detector: a Detector only the caller is using
+        """
+        key = self.config_key(**config)
+        with self._lock:
+            idle = self._idle.get(key)
+            detector = idle.pop() if idle else None
+            generation = self._generation.get(key, 0)
+            if detector is None:
+                self.created += 1
+        if detector is None:
+            # built outside the lock, so that other configurations aren't held up
+            detector = Detector(**dict(key))
+        with self._lock:
+            self._in_use[id(detector)] = (key, generation)
+        return detector
+
+    def release(self, detector: Detector):
+        """Gives a Detector back to the pool. It is freed instead if its configuration was evicted while it was in use, or if enough are already idle.
+
+        Args:
+            detector (Detector): a Detector from `acquire`
+        """
+        with self._lock:
+            key, generation = self._in_use.pop(id(detector))
+            idle = self._idle.setdefault(key, [])
+            if generation == self._generation.get(key, 0) and len(idle) < self.max_idle:
+                idle.append(detector)
+                return
+        free_detector(detector)
+
+    @contextmanager
+    def detector(self, **config):
+        """Borrows a Detector for the length of a `with` block.
+
+        Args:
+            **config: Detector arguments that differ from DETECTOR_CONFIG
+
+        Yields:
+            Detector: a Detector only the caller is using
+        """
+        detector = self.acquire(**config)
+        try:
+            yield detector
+        finally:
+            self.release(detector)
+
+    def evict(self, **config) -> int:
+        """Frees the idle Detectors of one configuration. Detectors of that configuration that are in use are freed when they are released.
+
+        Args:
+            **config: Detector arguments that differ from DETECTOR_CONFIG
+
+        Returns:
+            int: the number of idle Detectors freed
+        """
+        key = self.config_key(**config)
+        with self._lock:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            idle = self._idle.pop(key, [])
+        for detector in idle:
+            free_detector(detector)
+        return len(idle)
+
+    def close(self) -> int:
+        """Frees every idle Detector, and every Detector in use once it is released. The pool can still be used afterwards.
+
+        Returns:
+            int: the number of idle Detectors freed
+        """
+        with self._lock:
+            for key, _ in self._in_use.values():
+                self._generation[key] = self._generation.get(key, 0) + 1
+            for key in self._idle:
+                self._generation[key] = self._generation.get(key, 0) + 1
+            idle = [detector for detectors in self._idle.values() for detector in detectors]
+            self._idle.clear()
+        for detector in idle:
+            free_detector(detector)
+        return len(idle)
+
+    def idle_count(self) -> int:
+        """The number of idle Detectors across every configuration."""
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+
+# the pool used by get_tags when no other pool is given
+detector_pool = DetectorPool()
+atexit.register(detector_pool.close)
+
+
+def get_tags(img, pool: DetectorPool = None, **config) -> list:
     """Gets a list of tags from an image.
 
     Args:
         img: the image, in grayscale
+        pool (DetectorPool, optional): the pool to borrow a Detector from. Defaults to detector_pool.
+        **config: Detector arguments that differ from DETECTOR_CONFIG, e.g. quad_decimate=2.0
 
     Returns:
         list: the list of tags found in the image
     """
-    cameraMatrix = np.array([1060.71, 0, 960, 0, 1060.71, 540, 0, 0, 1]).reshape((3, 3))
-
-    camera_params = (
-        cameraMatrix[0, 0],
-        cameraMatrix[1, 1],
-        cameraMatrix[0, 2],
-        cameraMatrix[1, 2],
-    )
-    at_detector = Detector(
-        families="tag36h11",
-        nthreads=1,
-        quad_decimate=1.0,
-        quad_sigma=0.0,
-        refine_edges=1,
-        decode_sharpening=0.25,
-        debug=0,
-    )
-
-    tags = at_detector.detect(img, True, camera_params=camera_params, tag_size=True)
+    if pool is None:
+        pool = detector_pool
+    with latency.stage("get_tags") as timer, pool.detector(**config) as at_detector:
+        tags = at_detector.detect(img, True, camera_params=CAMERA_PARAMS, tag_size=True)
+        timer.set_count(len(tags))
     return tags
 
 
+class DetectorScheduler:
+    """Picks quad_decimate and nthreads for each frame from the tags and detection times of recent frames.
+
+    Large, close tags are still found after decimating the image a few times, which makes detection several times faster. quad_decimate is the largest step that keeps the smallest recent tag at least `min_tag_size` pixels wide after decimation, and drops back to `decimate_steps[0]` as soon as a frame has no tags, so that small distant tags are searched for at full detail. nthreads grows while detection takes longer than the latency budget, up to the number of available cores, and shrinks while it takes less than half of it.
+
+    Attributes:
+        quad_decimate (float): the decimation for the next frame
+        nthreads (int): the thread count for the next frame
+        last_elapsed (float): the detection time of the last frame, in seconds
+        mean_elapsed (float): the moving average of the detection time, in seconds
+        timings (deque): one (elapsed, quad_decimate, nthreads, tag count) tuple per recent frame
+    """
+
+    def __init__(
+        self,
+        latency_budget=1 / 30,
+        min_tag_size=16,
+        decimate_steps=(1.0, 1.5, 2.0, 3.0, 4.0),
+        max_threads=None,
+        history=10,
+        smoothing=0.3,
+    ):
+        """Constructs a DetectorScheduler, starting at full detail on one thread.
+
+        Args:
+            latency_budget (float, optional): the detection time to stay under, in seconds
+            min_tag_size (int, optional): the least width a tag may have after decimation, in pixels
+            decimate_steps (tuple, optional): the quad_decimate values to choose from, in increasing order
+            max_threads (int, optional): the most threads to use. Defaults to the number of available cores.
+            history (int, optional): the number of recent frames to remember tag sizes and timings for
+            smoothing (float, optional): the weight of the newest detection time in mean_elapsed
+        """
+        if max_threads is None:
+            max_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        self.latency_budget = latency_budget
+        self.min_tag_size = min_tag_size
+        self.decimate_steps = decimate_steps
+        self.max_threads = max(1, max_threads)
+        self.smoothing = smoothing
+        self.tag_sizes = deque(maxlen=history)
+        self.timings = deque(maxlen=history)
+        self.quad_decimate = decimate_steps[0]
+        self.nthreads = 1
+        self.last_elapsed = None
+        self.mean_elapsed = None
+
+    def settings(self) -> dict:
+        """The Detector arguments for the next frame.
+
+        Returns:
+            dict: quad_decimate and nthreads, to pass to get_tags or a DetectorPool
+        """
+        return {"quad_decimate": self.quad_decimate, "nthreads": self.nthreads}
+
+    def record(self, tags: list, elapsed: float):
+        """Updates the settings after a frame.
+
+        Args:
+            tags (list): the tags found in the frame
+            elapsed (float): how long detection took, in seconds
+        """
+        self.timings.append((elapsed, self.quad_decimate, self.nthreads, len(tags)))
+        self.last_elapsed = elapsed
+        if self.mean_elapsed is None:
+            self.mean_elapsed = elapsed
+        else:
+            self.mean_elapsed += self.smoothing * (elapsed - self.mean_elapsed)
+
+        # decimation, from the smallest tag seen recently
+        if len(tags) > 0:
+            self.tag_sizes.append(min(tag_size(tag) for tag in tags))
+            smallest = min(self.tag_sizes)
+            self.quad_decimate = self.decimate_steps[0]
+            for step in self.decimate_steps:
+                if smallest / step >= self.min_tag_size:
+                    self.quad_decimate = step
+        else:
+            self.tag_sizes.clear()
+            self.quad_decimate = self.decimate_steps[0]
+
+        # threads, from the latency budget
+        if self.mean_elapsed > self.latency_budget and self.nthreads < self.max_threads:
+            self.nthreads += 1
+        elif self.mean_elapsed < self.latency_budget / 2 and self.nthreads > 1:
+            self.nthreads -= 1
+
+    def detect(self, img, pool: DetectorPool = None, **config) -> list:
+        """Finds the tags in a frame with the current settings, then updates them.
+
+        Args:
+            img: the image, in grayscale
+            pool (DetectorPool, optional): the pool to borrow a Detector from. Defaults to detector_pool.
+            **config: other Detector arguments that differ from DETECTOR_CONFIG
+
+        Returns:
+            list: the list of tags found in the image
+        """
+        start = time.perf_counter()
+        tags = get_tags(img, pool, **config, **self.settings())
+        self.record(tags, time.perf_counter() - start)
+        return tags
+
+
+def tag_size(tag) -> float:
+    """The apparent size of a tag, as the length of its shortest side.
+
+    Args:
+        tag: a tag found by a Detector
+
+    Returns:
+        float: the length of the shortest side of the tag, in pixels
+    """
+    sides = tag.corners - np.roll(tag.corners, 1, axis=0)
+    return float(np.hypot(sides[:, 0], sides[:, 1]).min())
+
+
 def get_positions(tags: list) -> list[tuple[float, float, int]]:
     """A representation of the tag using only the pixel coordinates.
 
@@ -66,10 +353,40 @@ def error_relative_to_center(
     ]
 
 
-def output_from_tags(errors, horizontal_pid: PID, vertical_pid: PID) -> tuple[list[float], list[float]]:
-    horizontal_output = [horizontal_pid.update(error[0]) for error in errors]
-    vertical_output = [vertical_pid.update(error[1]) for error in errors]
-    return (horizontal_output, vertical_output)
+def tag_pids(K_p: float, K_i: float, K_d: float, integral_limit: float = None, clock=time.monotonic) -> PIDBank:
+    """A bank of PIDs with a horizontal and a vertical controller for every tag ID, so that each tag keeps its own state.
+
+    Args:
+        K_p (float): the proportional gain
+        K_i (float): the integral gain
+        K_d (float): the derivative gain
+        integral_limit (float, optional): the integral limit
+        clock (callable, optional): returns the current time in seconds
+
+    Returns:
+        PIDBank: the controllers, the horizontal one of tag i at row 2 * i and the vertical one at row 2 * i + 1
+    """
+    return PIDBank(2 * TAG_IDS, K_p, K_i, K_d, integral_limit, clock)
+
+
+def output_from_tags(errors, pids: PIDBank) -> tuple[list[float], list[float]]:
+    """Updates the PIDs of every tag in one call.
+
+    Args:
+        errors (list[tuple[float, float, int]]): the error of each tag, typically the output of error_relative_to_center
+        pids (PIDBank): the controllers of each tag, typically made by tag_pids
+
+    Returns:
+        tuple[list[float], list[float]]: the horizontal and the vertical output of each tag
+    """
+    with latency.stage("pid"):
+        if len(errors) == 0:
+            return ([], [])
+        errors = np.asarray(errors, dtype=float)
+        ids = errors[:, 2].astype(int)
+        indices = np.column_stack((2 * ids, 2 * ids + 1)).ravel()
+        outputs = pids.update(errors[:, :2].ravel(), indices=indices).reshape(-1, 2)
+    return (outputs[:, 0].tolist(), outputs[:, 1].tolist())
 
 def draw_outputs(img, outputs: tuple[list[float], list[float]], tags):
     h_off_center = 25
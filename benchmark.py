@@ -0,0 +1,210 @@
+"""
+Benchmarks the lane and tag pipelines over the bundled images, and checks them against a saved baseline
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import april_tags
+import latency
+from pid import *
+from pid_from_frame import process_frame
+from video_maker import render_frame
+
+# CONSTANTS
+LANE_IMAGES = sorted(glob.glob("frames/*.jpg")) + ["frame_from_auv.jpg", "rov_pool.jpg", "lights_test.jpg"]
+TAG_IMAGES = ["april_frame1.jpg"]
+RESOLUTIONS = [(1920, 1080), (1280, 720), (640, 360)]
+THRESHOLD = 0.2  # the fraction a timing may grow by before it counts as a regression
+MIN_REGRESSION_MS = 0.05  # differences smaller than this are noise, whatever the fraction
+
+
+def load_images(paths, resolution):
+    """Reads images and resizes them.
+
+    Args:
+        paths (list[str]): the images to read
+        resolution (tuple[int, int]): the (width, height) to resize them to
+
+    Returns:
+        list[np.ndarray]: the resized images, in BGR
+    """
+    images = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(path)
+        if image.shape[1::-1] != tuple(resolution):
+            image = cv2.resize(image, resolution, interpolation=cv2.INTER_AREA)
+        images.append(image)
+    return images
+
+
+def time_calls(function, inputs, repeats):
+    """Times a function over every input, `repeats` times, after one warm up pass.
+
+    Args:
+        function (callable): the function to time, called with one input
+        inputs (list): the inputs
+        repeats (int): the number of timed passes
+
+    Returns:
+        np.ndarray: the wall time of each call, in milliseconds
+    """
+    for item in inputs:
+        function(item)
+    times = []
+    for _ in range(repeats):
+        for item in inputs:
+            start = time.perf_counter()
+            function(item)
+            times.append(time.perf_counter() - start)
+    return 1000 * np.array(times)
+
+
+def stats(milliseconds):
+    """Latency percentiles and throughput of a list of timings."""
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        "calls": int(len(milliseconds)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(np.mean(milliseconds)),
+        "per_sec": float(1000 / np.mean(milliseconds)),
+    }
+
+
+def run_benchmarks(resolutions=RESOLUTIONS, repeats=3):
+    """Times every pipeline stage, and the render_frame, process_frame and get_tags paths, at each resolution.
+
+    Stage timings come from the `latency` recorder while render_frame runs, so they match what the pipeline does.
+
+    Args:
+        resolutions (list[tuple[int, int]], optional): the (width, height) to run at
+        repeats (int, optional): the number of timed passes over the images
+
+    Returns:
+        dict: for each resolution, e.g. "1920x1080", the stats of each benchmark, keyed by name
+    """
+    results = {}
+    for resolution in resolutions:
+        key = f"{resolution[0]}x{resolution[1]}"
+        lane_images = load_images(LANE_IMAGES, resolution)
+        tag_images = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image in load_images(TAG_IMAGES, resolution)]
+        results[key] = {}
+
+        # render_frame draws on its input, so each call gets a fresh copy
+        recorder = latency.enable()
+        render_times = time_calls(lambda image: render_frame(image.copy()), lane_images, repeats)
+        latency.disable()
+        results[key]["render_frame"] = stats(render_times)
+        stages = {}
+        for frame, stage, _, seconds, _ in recorder.records:
+            # frames are numbered from 0, so the first ones are the warm up pass
+            if frame >= len(lane_images) and stage != "frame":
+                stages.setdefault(stage, []).append(1000 * seconds)
+        for stage, milliseconds in stages.items():
+            results[key][stage] = stats(milliseconds)
+
+        pids = [PID(0.1, 0, 0, 100) for _ in range(3)]
+        results[key]["process_frame"] = stats(
+            time_calls(lambda image: process_frame(image, *pids), lane_images, repeats)
+        )
+        results[key]["get_tags"] = stats(time_calls(april_tags.get_tags, tag_images, repeats))
+    return results
+
+
+def compare(baseline, results, threshold=THRESHOLD, min_ms=MIN_REGRESSION_MS):
+    """Finds the benchmarks whose median got slower than the baseline by more than `threshold`.
+
+    Args:
+        baseline (dict): results saved earlier
+        results (dict): new results
+        threshold (float, optional): the fraction the median may grow by
+        min_ms (float, optional): the least growth, in milliseconds, that counts
+
+    Returns:
+        list[tuple[str, str, float, float]]: (resolution, benchmark, baseline p50, new p50) of each regression
+    """
+    regressions = []
+    for resolution, benchmarks in results.items():
+        for name, current in benchmarks.items():
+            previous = baseline.get(resolution, {}).get(name)
+            if previous is None:
+                continue
+            growth = current["p50_ms"] - previous["p50_ms"]
+            if growth > min_ms and growth > threshold * previous["p50_ms"]:
+                regressions.append((resolution, name, previous["p50_ms"], current["p50_ms"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """Prints one table per resolution, with the change against the baseline if there is one."""
+    for resolution, benchmarks in results.items():
+        print(f"\n{resolution}")
+        print(f"{'benchmark':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'per sec':>9}{'vs base':>9}")
+        for name, result in sorted(benchmarks.items(), key=lambda item: -item[1]["p50_ms"]):
+            change = ""
+            previous = (baseline or {}).get(resolution, {}).get(name)
+            if previous is not None and previous["p50_ms"] > 0:
+                change = f"{100 * (result['p50_ms'] / previous['p50_ms'] - 1):+.0f}%"
+            print(
+                f"{name:<18}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                f"{result['per_sec']:>9.1f}{change:>9}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the lane and tag pipelines over the bundled images")
+    parser.add_argument("--save", type=str, default=None, help="write the results to this JSON file, as a new baseline")
+    parser.add_argument("--baseline", type=str, default=None, help="compare against this JSON file, and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="the fraction a median may grow by before it fails")
+    parser.add_argument("--repeats", type=int, default=3, help="the number of timed passes over the images")
+    parser.add_argument("--resolutions", type=str, nargs="+", default=None, help="e.g. 1920x1080 640x360")
+    args = parser.parse_args()
+
+    resolutions = RESOLUTIONS
+    if args.resolutions:
+        resolutions = [tuple(int(size) for size in resolution.split("x")) for resolution in args.resolutions]
+
+    results = run_benchmarks(resolutions, args.repeats)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(
+                {
+                    "machine": {
+                        "python": platform.python_version(),
+                        "opencv": cv2.__version__,
+                        "numpy": np.__version__,
+                        "cpus": os.cpu_count(),
+                        "platform": platform.platform(),
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+        print(f"\nSaved the results to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        for resolution, name, before, after in regressions:
+            print(f"REGRESSION {resolution} {name}: {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions.")
@@ -0,0 +1,189 @@
+"""
+Fixed-rate control loop, decoupled from the rate vision measurements arrive at
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from pid import *
+
+STALE_POLICIES = ("hold", "decay", "zero")
+
+
+class ControlLoop:
+    """Updates a bank of PIDs at a fixed rate on a thread of its own, or as a task of an event loop, from the newest vision measurement.
+
+    Vision calls `measure` with the errors of each frame and the time the frame was captured, at whatever rate frames are processed. Every tick, the loop updates the PIDs once and hands their outputs to the sink, so actuators are driven at a steady rate however slow or uneven the vision is. With `max_extrapolation` set, the error is also extrapolated by the measurement age along its rate of change between the last two measurements, so that a slow frame does not look like a step. That only suits errors that change continuously; the lane errors jump, e.g. longitudinal between 0 and 100, and extrapolating a jump overshoots it, so it is off by default. Once the newest measurement is older than `stale_after`, the PIDs are no longer updated and the outputs are held, decayed towards 0, or zeroed; the PIDs are reset when fresh measurements return, so that the integral and derivative do not span the gap, and seeded with the fresh errors, so that the first update does not see a step from 0.
+
+        loop = ControlLoop(PIDBank(3, K_p=[0.1, 0.1, 0.5], integral_limit=100), rate=50, sink=send)
+        with loop:
+            while True:
+                frame = video.wait_frame()
+                errors = errors_from_frame(frame)
+                if errors is not None:
+                    loop.measure(errors, video.latest_timestamp)
+
+    Attributes:
+        pids (PIDBank): the controllers, one per error
+        rate (float): the ticks per second
+        outputs (np.ndarray): the outputs of the last tick
+        ticks (int): the number of ticks run
+        stale_ticks (int): the number of ticks run without a fresh measurement
+        overruns (int): the number of ticks skipped because the loop fell behind
+        measurements (int): the number of measurements received
+        stale (bool): whether the newest measurement is stale
+    """
+
+    def __init__(
+        self,
+        pids: PIDBank,
+        rate=50.0,
+        stale_after=0.5,
+        stale_policy="decay",
+        decay_time=0.5,
+        max_extrapolation=0.0,
+        sink=None,
+    ):
+        """Constructs a ControlLoop. Ticks start with `start`, or are run one at a time with `step`.
+
+        Args:
+            pids (PIDBank): the controllers, one per error. The loop keeps time with their clock, so timestamps passed to `measure` must come from it too; the default is `time.monotonic`, like FrameMailbox timestamps.
+            rate (float, optional): the ticks per second
+            stale_after (float, optional): how old the newest measurement may be before it is ignored, in seconds
+            stale_policy (str, optional): 'hold', 'decay' or 'zero', what happens to the outputs while measurements are stale
+            decay_time (float, optional): the time constant of the 'decay' policy, in seconds
+            max_extrapolation (float, optional): the longest time an error is extrapolated over, in seconds, e.g. 0.2 for errors that change continuously. Defaults to 0, which turns age compensation off, for errors that jump.
+            sink (callable, optional): called with the outputs and the time of each tick, on the loop thread
+        """
+        if stale_policy not in STALE_POLICIES:
+            raise ValueError(f"unknown stale policy {stale_policy}")
+        self.pids = pids
+        self.rate = rate
+        self.stale_after = stale_after
+        self.stale_policy = stale_policy
+        self.decay_time = decay_time
+        self.max_extrapolation = max_extrapolation
+        self.sink = sink
+        self.clock = pids.clock
+
+        self.outputs = np.zeros(pids.size)
+        self.ticks = 0
+        self.stale_ticks = 0
+        self.overruns = 0
+        self.measurements = 0
+        self.stale = True
+
+        self._lock = threading.Lock()
+        self._errors = self._timestamp = None
+        self._error_rate = None
+        self._last_tick = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def measure(self, errors, timestamp=None):
+        """Replaces the measurement the loop controls from. Can be called from any thread.
+
+        Args:
+            errors (array): the error of each controller
+            timestamp (float, optional): when the frame the errors came from was captured, on the PIDs' clock. Defaults to now.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        errors = np.asarray(errors, dtype=float)
+        with self._lock:
+            if self._timestamp is not None and 0 < timestamp - self._timestamp <= self.stale_after:
+                self._error_rate = (errors - self._errors) / (timestamp - self._timestamp)
+            elif self._timestamp is None or timestamp - self._timestamp > self.stale_after:
+                self._error_rate = None
+            else:
+                # out of order, or a second measurement of the same frame
+                return
+            self._errors = errors
+            self._timestamp = timestamp
+            self.measurements += 1
+
+    def step(self) -> np.ndarray:
+        """Runs one tick: updates the PIDs from the newest measurement, or applies the stale policy, and calls the sink.
+
+        Returns:
+            np.ndarray: the outputs
+        """
+        now = self.clock()
+        with self._lock:
+            errors, timestamp, error_rate = self._errors, self._timestamp, self._error_rate
+
+        if timestamp is None or now - timestamp > self.stale_after:
+            self.stale = True
+            self.stale_ticks += 1
+            if self.stale_policy == "zero":
+                self.outputs = np.zeros(self.pids.size)
+            elif self.stale_policy == "decay" and self._last_tick is not None:
+                self.outputs = self.outputs * np.exp(-(now - self._last_tick) / self.decay_time)
+        else:
+            if error_rate is not None and self.max_extrapolation > 0:
+                errors = errors + error_rate * min(max(now - timestamp, 0.0), self.max_extrapolation)
+            if self.stale:
+                # start over as if the previous tick had seen the same errors, so that the first
+                # update has a full tick of dt and no derivative kick
+                self.pids.reset(last_error=errors, last_time=now - 1 / self.rate)
+                self.stale = False
+            self.outputs = self.pids.update(errors)
+
+        self._last_tick = now
+        self.ticks += 1
+        if self.sink is not None:
+            self.sink(self.outputs, now)
+        return self.outputs
+
+    def start(self):
+        """Starts the loop thread."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the loop thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    async def run_async(self):
+        """Runs the ticks as a task of the running event loop instead of a thread, until the task is cancelled. The sink is called on the event loop, so it must not block."""
+        period = 1 / self.rate
+        next_tick = time.monotonic()
+        while True:
+            self.step()
+            next_tick, delay = self._schedule(next_tick, period)
+            await asyncio.sleep(delay)
+
+    def _run(self):
+        period = 1 / self.rate
+        next_tick = time.monotonic()
+        while not self._stopping.is_set():
+            self.step()
+            next_tick, delay = self._schedule(next_tick, period)
+            self._stopping.wait(delay)
+
+    def _schedule(self, next_tick, period):
+        """The time of the tick after `next_tick`, and the wait until it."""
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            # skip the ticks that were missed rather than running them back to back
+            missed = int(-delay // period) + 1
+            self.overruns += missed
+            next_tick += missed * period
+            delay = next_tick - time.monotonic()
+        return next_tick, max(delay, 0.0)
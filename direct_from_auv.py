@@ -3,17 +3,124 @@
 BlueRov video capture class
 """
 
+import threading
+import time
+
 import cv2
 import gi
 import numpy as np
 
+from frame_mailbox import FrameMailbox
+
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 
 
-class Video():
+def frame_layout(caps):
+    """Shape and strides of the BGR frames described by caps
+
+    GStreamer pads each row of a packed RGB frame to a multiple of 4 bytes.
+
+    Args:
+        caps (Gst.Caps): the caps of a sample
+
+    Returns:
+        tuple: (shape, strides) of the frame as an np.ndarray
+    """
+    caps_structure = caps.get_structure(0)
+    height = caps_structure.get_value('height')
+    width = caps_structure.get_value('width')
+    stride = (width * 3 + 3) // 4 * 4
+    return (height, width, 3), (stride, 3, 1)
+
+
+class MappedFrame():
+    """A frame that is a read-only view of a mapped Gst buffer, without any copy
+
+    The sample, and the buffer it holds, stay alive until `release` is called.
+    Holding on to too many mapped frames can starve the decoder of buffers.
+
+    Attributes:
+        array (np.ndarray): the read-only BGR view of the buffer, or None once released
+    """
+
+    def __init__(self, sample):
+        """Maps the buffer of a sample
+
+        Args:
+            sample (Gst.Sample): the sample pulled from the appsink
+        """
+        self.map_info = None
+        self.sample = sample
+        self.buffer = sample.get_buffer()
+        success, self.map_info = self.buffer.map(Gst.MapFlags.READ)
+        if not success:
+            self.map_info = None
+            raise RuntimeError('could not map the Gst buffer')
+        shape, strides = frame_layout(sample.get_caps())
+        self.array = np.ndarray(shape, dtype=np.uint8, buffer=self.map_info.data, strides=strides)
+        self.array.flags.writeable = False
+
+    def release(self):
+        """Unmaps the buffer. The array must not be used afterwards."""
+        if self.map_info is not None:
+            self.array = None
+            self.buffer.unmap(self.map_info)
+            self.map_info = self.buffer = self.sample = None
+
+    def __del__(self):
+        self.release()
+
+
+class FramePool():
+    """Preallocated frames that are handed out and given back, so that consumers can own
+    frames without one being allocated for every sample
+
+    Attributes:
+        shape (tuple): the shape of each frame
+    """
+
+    def __init__(self, frames, shape, dtype=np.uint8):
+        """Allocates the frames
+
+        Args:
+            frames (int): the number of frames
+            shape (tuple): the shape of each frame
+            dtype (np.dtype, optional): the type of each frame
+        """
+        self.shape = tuple(shape)
+        self._lock = threading.Lock()
+        self._free = [np.empty(self.shape, dtype=dtype) for _ in range(frames)]
+
+    def acquire(self):
+        """Takes a free frame
+
+        Returns:
+            np.ndarray: the frame, or None if every frame is in use
+        """
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def release(self, frame):
+        """Gives a frame back, once it is no longer needed. Frames of another shape,
+        from a pool that was replaced when the stream changed size, are ignored.
+
+        Args:
+            frame (np.ndarray): a frame from `acquire`
+        """
+        if frame.shape != self.shape:
+            return
+        with self._lock:
+            self._free.append(frame)
+
+
+class Video(FrameMailbox):
     """BlueRov video capture class constructor
 
+    Frames are received on the GStreamer streaming thread and handed over through a
+    FrameMailbox: `frame` takes the newest frame if there is one, and `wait_frame`
+    sleeps until one arrives. Frames are numbered and timestamped as they arrive.
+
     Attributes:
         port (int): Video UDP port
         video_codec (string): Source h264 parser
@@ -23,19 +130,45 @@ class Video():
         video_sink_conf (string): Sink configuration
         video_source (string): Udp source ip and port
         latest_frame (np.ndarray): Latest retrieved video frame
+        latest_sequence (int): Sequence number of latest_frame
+        latest_timestamp (float): When latest_frame arrived, in `time.monotonic` seconds
+        overwritten_frames (int): Frames replaced by a newer one before they were retrieved
+        dropped_frames (int): Frames thrown away because the frame pool was exhausted
+        ring_dropped_frames (int): Frames not published to the ring because it was full
+        ring (FrameRing): Shared memory that new frames are published to, if any
+        buffer_mode (string): How frames are taken out of Gst buffers, see the constructor
+        frame_pool (FramePool): The recycled frames of the 'pool' buffer mode
     """
 
-    def __init__(self, port=5600):
+    def __init__(self, port=5600, ring=None, buffer_mode='copy', pool_size=4):
         """Summary
 
         Args:
             port (int, optional): UDP port
+            ring (FrameRing, optional): if given, every new frame is also copied into a free
+                slot of this ring and published, so that other processes can `receive` it.
+                Frames are dropped when no slot is free.
+            buffer_mode (str, optional): 'copy' copies each buffer into a new array.
+                'mapped' maps each buffer read-only and gives out views of it, without any copy.
+                'pool' copies each buffer into a recycled frame of a preallocated FramePool,
+                and drops frames when none is free.
+                In 'mapped' and 'pool' modes, a frame returned by `frame` or `wait_frame`
+                is only valid until the next frame is taken.
+            pool_size (int, optional): the number of frames in the pool of the 'pool' mode
         """
 
+        if buffer_mode not in ('copy', 'mapped', 'pool'):
+            raise ValueError('unknown buffer mode {}'.format(buffer_mode))
+
         Gst.init(None)
+        super().__init__()
 
         self.port = port
-        self.latest_frame = self._new_frame = None
+        self.ring = ring
+        self.ring_dropped_frames = 0
+        self.buffer_mode = buffer_mode
+        self.pool_size = pool_size
+        self.frame_pool = None
 
         # [Software component diagram](https://www.ardusub.com/software/components.html)
         # UDP video stream (:5600)
@@ -44,8 +177,9 @@ class Video():
         # Cam -> CSI-2 -> H264 Raw (YUV 4-4-4 (12bits) I420)
         self.video_codec = '! application/x-rtp, payload=96 ! rtph264depay ! h264parse ! avdec_h264'
         # Python don't have nibble, convert YUV nibbles (4-4-4) to OpenCV standard BGR bytes (8-8-8)
+        # avdec_h264 already outputs raw video, so a single conversion is enough
         self.video_decode = \
-            '! decodebin ! videoconvert ! video/x-raw,format=(string)BGR ! videoconvert'
+            '! videoconvert ! video/x-raw,format=(string)BGR'
         # Create a sink to get data
         self.video_sink_conf = \
             '! appsink emit-signals=true sync=false max-buffers=2 drop=true'
@@ -102,25 +236,65 @@ class Video():
             buffer=buf.extract_dup(0, buf.get_size()), dtype=np.uint8)
         return array
 
-    def frame(self):
-        """ Get Frame
+    @staticmethod
+    def gst_to_pool(sample, pool):
+        """Copy a sample straight from the mapped Gst buffer into a free frame of `pool`
+
+        Args:
+            sample (Gst.Sample): the sample pulled from the appsink
+            pool (FramePool): the pool to take a frame from
 
         Returns:
-            np.ndarray: latest retrieved image frame
+            np.ndarray: the frame, or None if it was dropped because every frame was in use
         """
-        if self.frame_available:
-            self.latest_frame = self._new_frame
-            # reset to indicate latest frame has been 'consumed'
-            self._new_frame = None
-        return self.latest_frame
+        frame = pool.acquire()
+        if frame is None:
+            return None
+        mapped = MappedFrame(sample)
+        try:
+            frame[...] = mapped.array
+        finally:
+            mapped.release()
+        return frame
 
-    def frame_available(self):
-        """Check if a new frame is available
+    @staticmethod
+    def gst_to_ring(sample, ring, info=None):
+        """Copy a sample straight from the mapped Gst buffer into a free slot of `ring`, and publish it
+
+        Args:
+            sample (Gst.Sample): the sample pulled from the appsink
+            ring (FrameRing): the ring to publish to
+            info (optional): passed to `FrameRing.publish`
 
         Returns:
-            bool: true if a new frame is available
+            bool: false if the frame was dropped because every slot was in use
         """
-        return self._new_frame is not None
+        slot = ring.acquire(block=False)
+        if slot is None:
+            return False
+        buf = sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            ring.release(slot)
+            return False
+        try:
+            frame = ring[slot]
+            shape, strides = frame_layout(sample.get_caps())
+            frame[...] = np.ndarray(shape, dtype=np.uint8, buffer=map_info.data, strides=strides)
+        finally:
+            buf.unmap(map_info)
+        ring.publish(slot, info)
+        return True
+
+    def _as_array(self, frame):
+        return frame.array if isinstance(frame, MappedFrame) else frame
+
+    def _release(self, frame):
+        """Give back what a frame holds: its mapped buffer, or its frame of the pool"""
+        if isinstance(frame, MappedFrame):
+            frame.release()
+        elif frame is not None and self.buffer_mode == 'pool':
+            self.frame_pool.release(frame)
 
     def run(self):
         """ Get frame to update _new_frame
@@ -137,8 +311,24 @@ class Video():
         self.video_sink.connect('new-sample', self.callback)
 
     def callback(self, sink):
+        timestamp = time.monotonic()
         sample = sink.emit('pull-sample')
-        self._new_frame = self.gst_to_opencv(sample)
+        if self.buffer_mode == 'mapped':
+            new_frame = MappedFrame(sample)
+        elif self.buffer_mode == 'pool':
+            shape, _ = frame_layout(sample.get_caps())
+            if self.frame_pool is None or self.frame_pool.shape != shape:
+                self.frame_pool = FramePool(self.pool_size, shape)
+            new_frame = self.gst_to_pool(sample, self.frame_pool)
+        else:
+            new_frame = self.gst_to_opencv(sample)
+
+        if new_frame is None:
+            sequence = self.drop_frame()
+        else:
+            sequence = self.put_frame(new_frame, timestamp)
+        if self.ring is not None and not self.gst_to_ring(sample, self.ring, sequence):
+            self.ring_dropped_frames += 1
 
         return Gst.FlowReturn.OK
 
@@ -150,18 +340,18 @@ if __name__ == '__main__':
 
     print('Initialising stream...')
     waited = 0
-    while not video.frame_available():
+    while video.wait_frame(timeout=0.03) is None:
         waited += 1
         print('\r  Frame not available (x{})'.format(waited), end='')
-        cv2.waitKey(30)
     print('\nSuccess!\nStarting streaming - press "q" to quit.')
 
     while True:
-        # Wait for the next frame to become available
-        if video.frame_available():
-            # Only retrieve and display a frame if it's new
-            frame = video.frame()
+        # Sleep until the next frame arrives, then display it
+        frame = video.wait_frame(timeout=1)
+        if frame is not None:
             cv2.imshow('frame', frame)
         # Allow frame to display, and check if user wants to quit
         if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
\ No newline at end of file
+            break
+    print('{} frames, {} shown, {} overwritten, {} dropped'.format(
+        video.frame_count, video.consumed_frames, video.overwritten_frames, video.dropped_frames))
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Latest frame mailbox between the thread that receives frames and the threads that use them
+"""
+
+import threading
+import time
+
+
+class FrameMailbox:
+    """Holds the newest frame of a video source until a consumer takes it.
+
+    A producer thread calls `put_frame` for each frame it receives, and `drop_frame` for each frame it had to throw away. Consumers call `frame` to take the newest frame if there is one, or `wait_frame` to sleep until one arrives. Only the newest frame is kept: a frame that is replaced before it is taken is counted as overwritten.
+
+    Attributes:
+        latest_frame (np.ndarray): the frame taken last
+        latest_sequence (int): the sequence number of latest_frame, counting every frame received from 0
+        latest_timestamp (float): when latest_frame was received, in `time.monotonic` seconds
+        frame_count (int): the number of frames received, including dropped ones
+        consumed_frames (int): the number of frames taken by consumers
+        overwritten_frames (int): the number of frames replaced by a newer one before they were taken
+        dropped_frames (int): the number of frames the producer threw away
+    """
+
+    def __init__(self):
+        """Constructs an empty mailbox."""
+        self._condition = threading.Condition()
+        self.frame_count = 0
+        self.consumed_frames = 0
+        self.overwritten_frames = 0
+        self.dropped_frames = 0
+        self.latest_frame = self.latest_sequence = self.latest_timestamp = None
+        self._latest = None  # what latest_frame came from, released when it is replaced
+        self._new_frame = self._new_sequence = self._new_timestamp = None
+
+    def put_frame(self, frame, timestamp=None):
+        """Replaces the waiting frame with a new one, and wakes the consumers.
+
+        Args:
+            frame: the new frame
+            timestamp (float, optional): when the frame was received, in `time.monotonic` seconds. Defaults to now.
+
+        Returns:
+            int: the sequence number of the frame
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._condition:
+            sequence = self.frame_count
+            self.frame_count += 1
+            if self._new_frame is not None:
+                self.overwritten_frames += 1
+                self._release(self._new_frame)
+            self._new_frame = frame
+            self._new_sequence = sequence
+            self._new_timestamp = timestamp
+            self._condition.notify_all()
+        return sequence
+
+    def drop_frame(self):
+        """Counts a frame that was received but thrown away, e.g. because no buffer was free.
+
+        Returns:
+            int: the sequence number the frame would have had
+        """
+        with self._condition:
+            sequence = self.frame_count
+            self.frame_count += 1
+            self.dropped_frames += 1
+        return sequence
+
+    def frame(self):
+        """Takes the waiting frame, if there is one.
+
+        Returns:
+            np.ndarray: the new frame, or the frame taken last if no new frame arrived
+        """
+        with self._condition:
+            if self._new_frame is not None:
+                self._take()
+            return self.latest_frame
+
+    def wait_frame(self, timeout=None):
+        """Sleeps until a new frame arrives, then takes it.
+
+        Args:
+            timeout (float, optional): the longest time to wait, in seconds. Defaults to waiting forever.
+
+        Returns:
+            np.ndarray: the new frame, or None if none arrived in time
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._new_frame is not None, timeout):
+                return None
+            self._take()
+            return self.latest_frame
+
+    def frame_available(self):
+        """Check if a new frame is available
+
+        Returns:
+            bool: true if a new frame is available
+        """
+        return self._new_frame is not None
+
+    def frame_age(self):
+        """How long ago the frame taken last was received.
+
+        Returns:
+            float: the age in seconds, or None if no frame was taken yet
+        """
+        if self.latest_timestamp is None:
+            return None
+        return time.monotonic() - self.latest_timestamp
+
+    def _take(self):
+        """Makes the waiting frame the latest one. The condition must be held."""
+        self._release(self._latest)
+        self._latest = self._new_frame
+        self.latest_frame = self._as_array(self._new_frame)
+        self.latest_sequence = self._new_sequence
+        self.latest_timestamp = self._new_timestamp
+        # reset to indicate latest frame has been 'consumed'
+        self._new_frame = self._new_sequence = self._new_timestamp = None
+        self.consumed_frames += 1
+        # wake producers waiting for the mailbox to empty, e.g. a lockstep replay
+        self._condition.notify_all()
+
+    def _as_array(self, frame):
+        """The array of a frame that was put in the mailbox. Subclasses that put other objects convert them here."""
+        return frame
+
+    def _release(self, frame):
+        """Called with each frame that is replaced, either before or after it was taken. Subclasses that lend out buffers give them back here."""
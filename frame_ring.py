@@ -0,0 +1,127 @@
+"""
+Shared memory ring buffer for passing frames between processes
+"""
+
+import os
+import queue
+from multiprocessing import Queue, shared_memory
+
+import numpy as np
+
+
+class FrameRing:
+    """A fixed number of frame sized slots in one block of shared memory, exposed as numpy views.
+
+    Frames are never pickled: a producer takes a free slot with `acquire`, writes the frame into `ring[slot]`, and hands the slot index to a consumer, either through its own queue or with `publish`/`receive`. The consumer reads the view and gives the slot back with `release`. A ring can be passed to `multiprocessing.Process` arguments; the child attaches to the same memory.
+
+    Attributes:
+        slots (int): the number of frames the ring can hold
+        shape (tuple): the shape of each frame
+        dtype (np.dtype): the type of each frame
+        name (str): the name of the shared memory block
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+        """Creates the ring. The creating process owns the memory and must call `unlink` when every process is done with it.
+
+        Args:
+            slots (int): the number of frames the ring can hold
+            shape (tuple): the shape of each frame, e.g. (1080, 1920, 3)
+            dtype (np.dtype, optional): the type of each frame
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * frame_size)
+        self.name = self._shm.name
+        self._owner_pid = os.getpid()
+
+        self._free = Queue()
+        self._ready = Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._attach()
+
+    def _attach(self):
+        self._frames = np.ndarray((self.slots, *self.shape), dtype=self.dtype, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        return {
+            "slots": self.slots,
+            "shape": self.shape,
+            "dtype": self.dtype,
+            "name": self.name,
+            "_owner_pid": self._owner_pid,
+            "_free": self._free,
+            "_ready": self._ready,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._attach()
+
+    def __getitem__(self, slot):
+        """The numpy view of a slot. It stays valid until the ring is closed."""
+        return self._frames[slot]
+
+    def __len__(self):
+        return self.slots
+
+    def acquire(self, block=True, timeout=None):
+        """Takes a free slot to write a frame into.
+
+        Args:
+            block (bool, optional): whether to wait for a slot to be released
+            timeout (float, optional): the longest time to wait, in seconds
+
+        Returns:
+            int: the slot, or None if no slot became free
+        """
+        try:
+            return self._free.get(block, timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        """Gives a slot back, once its frame is no longer needed.
+
+        Args:
+            slot (int): the slot to release
+        """
+        self._free.put(slot)
+
+    def publish(self, slot, info=None):
+        """Hands a written slot to whichever consumer calls `receive` next.
+
+        Args:
+            slot (int): the slot holding the frame
+            info (optional): any small picklable value to send along, e.g. a frame number
+        """
+        self._ready.put((slot, info))
+
+    def receive(self, block=True, timeout=None):
+        """Takes the next published slot. The caller must `release` it when done.
+
+        Args:
+            block (bool, optional): whether to wait for a slot to be published
+            timeout (float, optional): the longest time to wait, in seconds
+
+        Returns:
+            tuple: (slot, info), or (None, None) if nothing was published in time
+        """
+        try:
+            return self._ready.get(block, timeout)
+        except queue.Empty:
+            return (None, None)
+
+    def close(self):
+        """Detaches this process from the shared memory. Views returned by the ring must not be used afterwards."""
+        self._frames = None
+        self._shm.close()
+
+    def unlink(self):
+        """Frees the shared memory. Only the creating process should call this, after `close`."""
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
@@ -0,0 +1,187 @@
+"""
+Asyncio frame sources for video files, RTSP streams and the GStreamer UDP stream
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import cv2
+
+# what the reader thread queues after the last frame
+_END = object()
+
+
+class FrameSource:
+    """Frames of a video source as an async iterator, so that several tasks can share one event loop:
+
+        async with CaptureSource("video.mkv") as source:
+            async for frame in source:
+                ...
+
+    Frames are read by a thread of their own, so blocking reads never run on the event loop, and handed over through a queue of at most `maxsize` frames. When the queue is full, the 'block' policy makes the reader wait for the consumer, so that no frame is lost, and the 'drop_oldest' policy throws away the oldest queued frame, so that the consumer always gets recent frames. Subclasses implement `read`, `release` if they hold resources, and `read_timestamp` if they know when a frame was captured better than when it was read.
+
+    Attributes:
+        policy (str): 'block' or 'drop_oldest'
+        maxsize (int): the most frames queued at once
+        read_frames (int): the number of frames read from the source
+        dropped_frames (int): the number of frames thrown away by the 'drop_oldest' policy
+        latest_timestamp (float): when the frame returned last was read, or captured, in `time.monotonic` seconds
+    """
+
+    def __init__(self, maxsize=2, policy="drop_oldest"):
+        """Constructs a FrameSource. Reading starts when iteration does.
+
+        Args:
+            maxsize (int, optional): the most frames queued at once
+            policy (str, optional): 'block' or 'drop_oldest', what to do when the queue is full
+        """
+        if policy not in ("block", "drop_oldest"):
+            raise ValueError(f"unknown policy {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.read_frames = 0
+        self.dropped_frames = 0
+        self.latest_timestamp = None
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def read(self):
+        """Reads the next frame, blocking until there is one. Runs on the reader thread.
+
+        Returns:
+            np.ndarray: the frame, or None at the end of the source
+        """
+        raise NotImplementedError
+
+    def release(self):
+        """Frees what the source holds, once the reader thread has stopped."""
+
+    def read_timestamp(self):
+        """When the frame `read` returned last was captured, in `time.monotonic` seconds. Defaults to now, i.e. when it was read. Runs on the reader thread."""
+        return time.monotonic()
+
+    def start(self):
+        """Starts the reader thread. Must be called from the event loop; iterating calls it."""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    async def close(self):
+        """Stops the reader thread and releases the source."""
+        self._stopping.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+        self.release()
+
+    def __aiter__(self):
+        self.start()
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            raise item
+        self.latest_timestamp, frame = item
+        return frame
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _read_loop(self):
+        try:
+            while not self._stopping.is_set():
+                frame = self.read()
+                if frame is None:
+                    break
+                self.read_frames += 1
+                self._put((self.read_timestamp(), frame))
+        except BaseException as error:
+            self._put(error, drop=False)
+        self._put(_END, drop=False)
+
+    def _put(self, item, drop=True):
+        """Hands an item to the event loop, following the policy. Runs on the reader thread."""
+        if self.policy == "drop_oldest" and drop:
+            self._loop.call_soon_threadsafe(self._put_drop_oldest, item)
+            return
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._stopping.is_set():
+                    future.cancel()
+                    return
+
+    def _put_drop_oldest(self, item):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped_frames += 1
+        self._queue.put_nowait(item)
+
+
+class CaptureSource(FrameSource):
+    """Frames read with a cv2.VideoCapture: a video file, an RTSP url such as rtsp://<ip>:8554/rovcam, or a GStreamer pipeline ending in appsink. The source ends at the first failed read."""
+
+    def __init__(self, uri, api_preference=cv2.CAP_ANY, maxsize=2, policy="drop_oldest"):
+        """Opens the capture.
+
+        Args:
+            uri (str): the path, url or pipeline to open
+            api_preference (int, optional): the OpenCV backend, e.g. cv2.CAP_GSTREAMER for a pipeline
+            maxsize (int, optional): the most frames queued at once
+            policy (str, optional): 'block' or 'drop_oldest'. Use 'block' for files, so that no frame is skipped.
+        """
+        super().__init__(maxsize, policy)
+        self.uri = uri
+        self.capture = cv2.VideoCapture(uri, api_preference)
+        if not self.capture.isOpened():
+            raise ValueError(f"could not open {uri}")
+
+    def read(self):
+        ret, frame = self.capture.read()
+        return frame if ret else None
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoSource(FrameSource):
+    """Frames of a direct_from_auv.Video, or of anything else with its `wait_frame` interface. The source never ends on its own, only when it is closed."""
+
+    def __init__(self, video, maxsize=2, policy="drop_oldest", poll_timeout=0.1):
+        """Wraps a Video.
+
+        Args:
+            video (Video): the video to take frames from
+            maxsize (int, optional): the most frames queued at once
+            policy (str, optional): 'block' or 'drop_oldest'
+            poll_timeout (float, optional): how often, in seconds, the reader checks whether the source was closed while no frames arrive
+        """
+        super().__init__(maxsize, policy)
+        self.video = video
+        self.poll_timeout = poll_timeout
+
+    def read(self):
+        while not self._stopping.is_set():
+            frame = self.video.wait_frame(timeout=self.poll_timeout)
+            if frame is not None:
+                # mapped and pooled frames are only valid until the next one is taken
+                if getattr(self.video, "buffer_mode", "copy") != "copy":
+                    frame = frame.copy()
+                return frame
+        return None
@@ -1,16 +1,18 @@
 import math
-from itertools import combinations
 from random import randrange
 
 import cv2
 import numpy as np
 import numpy.typing as npt
 from matplotlib import pyplot as plt
-from sklearn.cluster import DBSCAN
 from typing import Union
 
+import latency
 from Line import *
 
+# CONSTANTS
+MIN_LANE_CHUNK = 4  # the fewest lane candidates detect_lanes checks at once
+
 
 # ================
 # Helper Functions
@@ -92,6 +94,55 @@ def group_data(labels: list[int], data: list[any]) -> dict[int, any]:
     return grouped_data
 
 
+def group_line_set(labels: npt.NDArray[np.int_], lines: LineSet) -> dict[int, LineSet]:
+    """Group a LineSet based on labels, without unpacking it into Line objects. Labels keep the order they first appear in, like `group_data`.
+
+    ### Parameters
+    - labels (npt.NDArray[np.int_]): the label of each line, i.e. the cluster it should go to
+    - lines (LineSet): the lines to group
+
+    ### Returns
+    - dict[int, LineSet]: the lines mapped to their labels
+    """
+    labels = np.asarray(labels)
+    unique_labels, first_index = np.unique(labels, return_index=True)
+    grouped_lines = {}
+    for label in unique_labels[np.argsort(first_index)]:
+        if label == -1:
+            continue
+        grouped_lines[int(label)] = lines[labels == label]
+
+    return grouped_lines
+
+
+def cluster_1d(values: npt.ArrayLike, eps: float) -> npt.NDArray[np.int_]:
+    """Clusters one dimensional data by sorting it and splitting wherever the gap between neighbours is larger than `eps`.
+
+    This gives the same labels as `DBSCAN(eps=eps, min_samples=1).fit_predict(values)`, including the label numbering (clusters are numbered in the order their first element appears), without building an estimator. The only differences are gaps of exactly `eps`, where DBSCAN's distance calculation can round either way.
+
+    ### Parameters
+    - values (npt.ArrayLike): the data to cluster
+    - eps (float): the maximum distance between two neighbouring values in the same cluster
+
+    ### Returns
+    - npt.NDArray[np.int_]: the cluster label of each value
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int_)
+    order = np.argsort(values, kind="stable")
+    # a new cluster starts after every gap that is too big
+    sorted_labels = np.concatenate(([0], np.cumsum(np.diff(values[order]) > eps)))
+    labels = np.empty(len(values), dtype=np.int_)
+    labels[order] = sorted_labels
+
+    # renumber the clusters in order of first appearance, as DBSCAN does
+    _, first_index = np.unique(labels, return_index=True)
+    renumber = np.empty(len(first_index), dtype=np.int_)
+    renumber[np.argsort(first_index)] = np.arange(len(first_index))
+    return renumber[labels]
+
+
 def dist(a: Union[float, int], b: Union[float, int]) -> Union[float, int]:
     """returns the distance between `a` and `b`
 
@@ -180,6 +231,170 @@ def find_edges(
     return cv2.Canny(img, threshold1=t1, threshold2=t2, apertureSize=aperture)
 
 
+def box_sizes(kernel_size: int, passes: int = 3) -> list[int]:
+    """The sizes of `passes` box blurs which, applied one after another, approximate the Gaussian blur used by `to_blurred`.
+
+    ### Parameters
+    - kernel_size (int): the size of the Gaussian kernel being approximated
+    - passes (int, optional): the number of box blurs. Defaults to 3.
+
+    ### Returns
+    - list[int]: the (odd) size of each box blur
+    """
+    # the sigma OpenCV uses for a Gaussian kernel of this size, when sigma is 0
+    sigma = 0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(ideal) - (int(ideal) % 2 == 0)
+    n_lower = round(
+        (12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+        / (-4 * lower - 4)
+    )
+    return [lower] * n_lower + [lower + 2] * (passes - n_lower)
+
+
+class Preprocessor:
+    """Runs `split`, `to_gray`, `to_blurred`, `to_bw` and `find_edges` on a frame, writing every step into buffers it owns. Calls on frames of the same size allocate nothing.
+
+    With a `scale` below 1 the gray frame is shrunk before blurring, and the blur is shrunk with it, so the returned images are `scale` times the size of the split frame.
+
+    The returned images are reused by the next call, so copy them if they need to outlive it. One Preprocessor should not be shared between threads.
+    """
+
+    BLURS = ("gaussian", "box", "pyramid")
+
+    def __init__(
+        self,
+        kernel_size: int = 19,
+        t: int = 90,
+        white_value: int = 255,
+        t1: int = 50,
+        t2: int = 100,
+        aperture: int = 3,
+        blur: str = "gaussian",
+        scale: float = 1.0,
+    ):
+        """Constructs a Preprocessor. The parameters are the same as the functions it replaces.
+
+        ### Parameters
+        - kernel_size (int, optional): see `to_blurred`. Defaults to 19.
+        - t (int, optional): see `to_bw`. Defaults to 90.
+        - white_value (int, optional): see `to_bw`. Defaults to 255.
+        - t1 (int, optional): see `find_edges`. Defaults to 50.
+        - t2 (int, optional): see `find_edges`. Defaults to 100.
+        - aperture (int, optional): see `find_edges`. Defaults to 3.
+        - blur (str, optional): "gaussian" for the exact blur of `to_blurred`, "box" to approximate it with three box blurs, or "pyramid" to blur a half size copy and scale it back up. Defaults to "gaussian".
+        - scale (float, optional): the factor to resize the frame by before blurring. `kernel_size` is always given at full resolution. Defaults to 1.0.
+
+        ### Notes
+        On the bundled images, "box" is within 4 gray levels of the exact blur (1 on frames/) and roughly 2.5x faster; "pyramid" is within 23 gray levels (10 on frames/) and roughly 3x faster. test_lane_detection.py checks these tolerances.
+        """
+        if blur not in self.BLURS:
+            raise ValueError(f"unknown blur: {blur}, expected one of {self.BLURS}")
+        self.kernel_size = kernel_size
+        self.t = t
+        self.white_value = white_value
+        self.t1 = t1
+        self.t2 = t2
+        self.aperture = aperture
+        self.blur = blur
+        self.scale = scale
+        # the sigma OpenCV uses for a kernel of this size, shrunk along with the frame
+        self.sigma = (0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8) * scale
+        if scale == 1:
+            self.blur_kernel_size = kernel_size
+        else:
+            self.blur_kernel_size = max(3, 2 * round((self.sigma - 0.8) / 0.3 + 1) + 1)
+        self.box_sizes = box_sizes(self.blur_kernel_size)
+        self.shape = None
+
+    def allocate(self, shape: tuple[int, int]):
+        """(Re)allocates the buffers for split frames of `shape`.
+
+        ### Parameters
+        - shape (tuple[int, int]): the (height, width) of the split frame
+        """
+        self.shape = shape
+        if self.scale != 1:
+            self.full_gray = np.empty(shape, dtype=np.uint8)
+            shape = (max(1, round(shape[0] * self.scale)), max(1, round(shape[1] * self.scale)))
+        self.working_shape = shape
+        self.gray = np.empty(shape, dtype=np.uint8)
+        self.blurred = np.empty(shape, dtype=np.uint8)
+        self.bw = np.empty(shape, dtype=np.uint8)
+        self.edges = np.empty(shape, dtype=np.uint8)
+        self.scratch = np.empty(shape, dtype=np.uint8)
+        small = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+        self.small = np.empty(small, dtype=np.uint8)
+        self.small_blurred = np.empty(small, dtype=np.uint8)
+
+    def to_blurred(self, img: npt.NDArray[any]) -> npt.NDArray[any]:
+        """Blurs `img` into the blurred buffer, using the configured blur.
+
+        ### Parameters
+        - img (npt.NDArray[any]): the grayscale image to blur
+
+        ### Returns
+        - npt.NDArray[any]: the blurred buffer
+        """
+        if self.blur == "gaussian":
+            ksize = (self.blur_kernel_size, self.blur_kernel_size)
+            # at full scale, let OpenCV pick sigma exactly as to_blurred does
+            cv2.GaussianBlur(img, ksize, 0 if self.scale == 1 else self.sigma, dst=self.blurred)
+        elif self.blur == "box":
+            # alternate between the two buffers so that the last pass lands in blurred
+            src = img
+            for i, size in enumerate(self.box_sizes):
+                dst = self.blurred if (len(self.box_sizes) - i) % 2 == 1 else self.scratch
+                cv2.blur(src, (size, size), dst=dst)
+                src = dst
+        else:
+            # pyrDown already blurs with a sigma of about 1, the rest is done at half size
+            cv2.pyrDown(img, dst=self.small)
+            cv2.GaussianBlur(
+                self.small, (0, 0), math.sqrt(max(self.sigma**2 - 1, 0.25)) / 2, dst=self.small_blurred
+            )
+            cv2.resize(
+                self.small_blurred,
+                (self.working_shape[1], self.working_shape[0]),
+                dst=self.blurred,
+                interpolation=cv2.INTER_LINEAR,
+            )
+        return self.blurred
+
+    def __call__(self, frame: npt.NDArray[any]) -> tuple[npt.NDArray[any], npt.NDArray[any]]:
+        """Preprocesses a frame.
+
+        ### Parameters
+        - frame (npt.NDArray[any]): the full BGR frame
+
+        ### Returns
+        - tuple[npt.NDArray[any], npt.NDArray[any]]: (bw, edges), the black and white bottom half of the frame and its edges, resized by `scale`
+        """
+        with latency.stage("split"):
+            sliced = split(frame)
+        if sliced.shape[:2] != self.shape:
+            self.allocate(sliced.shape[:2])
+        with latency.stage("to_gray"):
+            if self.scale == 1:
+                cv2.cvtColor(sliced, cv2.COLOR_BGR2GRAY, dst=self.gray)
+            else:
+                # converting to gray first means only one channel has to be resized
+                cv2.cvtColor(sliced, cv2.COLOR_BGR2GRAY, dst=self.full_gray)
+                cv2.resize(
+                    self.full_gray,
+                    (self.working_shape[1], self.working_shape[0]),
+                    dst=self.gray,
+                    interpolation=cv2.INTER_AREA,
+                )
+        with latency.stage("to_blurred"):
+            self.to_blurred(self.gray)
+        with latency.stage("to_bw"):
+            cv2.threshold(self.blurred, self.t, self.white_value, cv2.THRESH_BINARY, dst=self.bw)
+        with latency.stage("find_edges"):
+            cv2.Canny(self.bw, self.t1, self.t2, edges=self.edges, apertureSize=self.aperture)
+        return self.bw, self.edges
+
+
 # ===================
 # Edge/line Detection
 # ===================
@@ -190,7 +405,7 @@ def find_lines(
     threshold=100,
     min_line_length=100,
     max_line_gap=20,
-) -> list[Line]:
+) -> LineSet:
     """Finds the line segments in the `edges` image. Assumes that `edges` has already been passed through a edge detection algorithm, such as canny.
 
     ### Parameters
@@ -202,7 +417,7 @@ def find_lines(
     - max_line_gap (int, optional): the upper threshold for Hough Lines. Defaults to 20.
 
     ### Returns
-    - list[Line]: a list of Line segments found in the image.
+    - LineSet: the line segments found in the image, packed into a single array.
     """
     height = edges.shape[0]
     lines = cv2.HoughLinesP(
@@ -213,106 +428,153 @@ def find_lines(
         minLineLength=min_line_length,
         maxLineGap=max_line_gap,
     )
-    try:
-        lines = [Line(line[0][0], line[0][1], line[0][2], line[0][3], image_height=height) for line in lines]
-        return lines
-    except TypeError:
-        # could not iterate over lines, because none were detected
-        return []
+    if lines is None:
+        # no lines were detected
+        return LineSet(np.empty((0, 4)), image_height=height)
+    return LineSet(lines, image_height=height)
 
 # ============
 # Line Merging
 # ============
 def group_lines(
-    lines: list[Line],
+    lines: Union[LineSet, list[Line]],
     height: int,
     slope_tolerance: float = 0.1,
     x_intercept_tolerance: int = 50,
+    method: str = "sort",
 ):
     """Returns a dictionary containing lines that have been seperated into groups.
 
     ### Parameters
-    - lines (list[Line]): the list of lines that need to be grouped
+    - lines (LineSet | list[Line]): the lines that need to be grouped
     - height (int): the height of the image. Required for calculating x-intercepts.
     - slope_tolerance (float, optional): the tolerance with which to group lines by slope. Defaults to 0.1.
     - x_intercept_tolerance (int, optional): the tolerance with which to group lines by x-intercept. Defaults to 50.
+    - method (str, optional): "sort" to cluster with `cluster_1d`, or "dbscan" to use scikit-learn's DBSCAN. Both give the same groups. Defaults to "sort".
 
     ### Returns
-    - dict[int: dict[int: list[Line]]] | None: the grouped lines, or None if len(lines) < 1
+    - dict[int: dict[int: LineSet]] | None: the grouped lines, or None if len(lines) < 1
     """
     if len(lines) < 1:
         return None
-    # Step 1. Group lines by slope
-    slopes = [line.slope for line in lines]
-    slopes = np.array(slopes).reshape(-1, 1)  # convert slopes to a 2d array
+    if not isinstance(lines, LineSet):
+        lines = LineSet.from_lines(lines, image_height=height)
+
+    if method == "sort":
+        cluster = cluster_1d
+    elif method == "dbscan":
+        # only import scikit-learn when it is asked for, it is slow to load
+        from sklearn.cluster import DBSCAN
 
-    dbscan = DBSCAN(eps=slope_tolerance, min_samples=1)
-    labels = dbscan.fit_predict(slopes)  # labels is a list of clusters, basically
-    grouped_lines = group_data(labels, lines)
+        def cluster(values, eps):
+            dbscan = DBSCAN(eps=eps, min_samples=1)
+            return dbscan.fit_predict(np.reshape(values, (-1, 1)))
+
+    else:
+        raise ValueError(f"unknown grouping method: {method}")
+
+    # Step 1. Group lines by slope
+    labels = cluster(lines.slope, slope_tolerance)  # labels is a list of clusters, basically
+    grouped_lines = group_line_set(labels, lines)
 
     # Step 2. Seperate each slope-group into x-intercept groupings
-    dbscan = DBSCAN(eps=x_intercept_tolerance, min_samples=1)
     for label, lines in grouped_lines.items():
-        x_intercepts = []
-        for line in lines:
-            if line.x_intercept == NO_X_INTERCEPT:
-                x_intercepts.append(
-                    line.y_intercept
-                )  # we want to group horizontal lines by y-intercept instead
-            else:
-                x_intercepts.append(line.x(height / 2))
-        x_intercepts = np.array(x_intercepts).reshape(-1, 1)
-        labels = dbscan.fit_predict(x_intercepts)
-        grouped_lines[label] = group_data(labels, lines)
+        # we want to group horizontal lines by y-intercept instead
+        x_intercepts = np.where(
+            lines.x_intercept == NO_X_INTERCEPT, lines.y_intercept, lines.x(height / 2)
+        )
+        labels = cluster(x_intercepts, x_intercept_tolerance)
+        grouped_lines[label] = group_line_set(labels, lines)
 
     return grouped_lines
 
 
+def merge_line_groups(
+    points: npt.NDArray[any], group_ids: npt.NDArray[np.int_], height: int, width: int
+) -> npt.NDArray[np.float64]:
+    """Fits a line of best fit through every group of line segments at once, and clips the fits to the image.
+
+    The least squares terms are segmented sums over `group_ids` (np.bincount), so the cost does not grow with the number of groups. Groups whose points all share an x-coordinate are merged into a vertical line, and groups whose fit rises or falls by less than half a pixel across the image into a horizontal line, instead of dividing by the slope. A horizontal line has no x-intercept, so it is never paired into a lane.
+
+    ### Parameters
+    - points (npt.NDArray[any]): (N, 4) array of [x1, y1, x2, y2] line segments
+    - group_ids (npt.NDArray[np.int_]): the group of each segment, from 0 to G - 1. Every group must contain at least one segment.
+    - height (int): the height of the image, required for clipping the line segments
+    - width (int): the width of the image, required for clipping the line segments
+
+    ### Returns
+    - npt.NDArray[np.float64]: (G, 4) array of merged segments, from the intercept with the bottom of the image to the intercept with the top
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 4)
+    n_groups = int(group_ids.max()) + 1 if len(group_ids) > 0 else 0
+    # every segment contributes both of its points to the fit
+    x = points[:, [0, 2]].ravel()
+    y = points[:, [1, 3]].ravel()
+    ids = np.repeat(group_ids, 2)
+
+    count = np.bincount(ids, minlength=n_groups)
+    x_mean = np.bincount(ids, weights=x, minlength=n_groups) / count
+    y_mean = np.bincount(ids, weights=y, minlength=n_groups) / count
+    # centered sums, which are better conditioned than the raw sums of squares
+    dx = x - x_mean[ids]
+    dy = y - y_mean[ids]
+    sxx = np.bincount(ids, weights=dx * dx, minlength=n_groups)
+    sxy = np.bincount(ids, weights=dx * dy, minlength=n_groups)
+
+    vertical = sxx <= 1e-9 * np.maximum(1.0, x_mean * x_mean)
+    m = np.divide(sxy, sxx, out=np.zeros(n_groups), where=~vertical)
+    b = y_mean - m * x_mean
+    # a slope this small is rounding error, which would put the intercepts far outside the image
+    horizontal = ~vertical & (np.abs(m) * width < 0.5)
+    sloped = ~(vertical | horizontal)
+
+    # y = mx + b
+    # (y - b) / m = x
+    y_list = np.empty((n_groups, 2))
+    y_list[:] = [height, 0]
+    x_list = np.empty((n_groups, 2))  # [intercept with bottom of image, intercept with top]
+    x_list[sloped] = (y_list[sloped] - b[sloped, None]) / m[sloped, None]
+
+    # Sometimes the intercepts will have negative coordinates. Clip them to the sides of the image.
+    too_low = sloped[:, None] & (x_list < 0)
+    too_high = sloped[:, None] & (x_list > width)
+    x_list[too_low] = 0
+    y_list[too_low] = np.broadcast_to(b[:, None], y_list.shape)[too_low]
+    x_list[too_high] = width
+    y_list[too_high] = np.broadcast_to((m * width + b)[:, None], y_list.shape)[too_high]
+
+    x_list[vertical] = x_mean[vertical, None]
+    x_list[horizontal] = [width, 0]
+    y_list[horizontal] = b[horizontal, None]
+
+    return np.stack([x_list[:, 0], y_list[:, 0], x_list[:, 1], y_list[:, 1]], axis=1)
+
+
 def merge_lines(
     grouped_lines, height: int, width: int
 ) -> list[Line]:
     """Merges groups of lines into individual lines.
 
     ### Parameters
-    - grouped_lines (dict[int : dict[int : list[Line]]]): the list of grouped lines, typically the output of `group_lines`
+    - grouped_lines (dict[int : dict[int : LineSet]]): the list of grouped lines, typically the output of `group_lines`
     - height (int): the height of the image, required for clipping the line segments
     - width (int): the width of the image, required for clipping the line segments
 
     ### Returns
     - list[Line]: the list of merged lines
     """
-    merged_lines = []
-    for _, slope_group in grouped_lines.items():
-        for _, x_group in slope_group.items():
-            # for each group, reset the x and y list
-            x_list = []
-            y_list = []
-            # create a list of all the x and y coordinates in the group
-            for line in x_group:
-                x_list.extend([line.x1, line.x2])
-                y_list.extend([line.y1, line.y2])
-            m, b = np.polyfit(x_list, y_list, 1)  # line of best fit for the points
-
-            # y = mx + b
-            # (y - b) / m = x
-            y_list = [height, 0]
-            x_list = [
-                (y_list[0] - b) / m,
-                (y_list[1] - b) / m,
-            ]  # [intercept with bottom of image, intercept with top]
-
-            # Sometimes the intercepts will have negative coordinates. The following if block fixes that.
-            for i in range(len(x_list)):
-                if x_list[i] < 0:
-                    x_list[i] = 0
-                    y_list[i] = b
-                elif x_list[i] > width:
-                    x_list[i] = width
-                    y_list[i] = m * width + b
-
-            # Finally, create and append the line segments.
-            merged_line = Line(x_list[0], y_list[0], x_list[1], y_list[1])
-            merged_lines.append(merged_line)
+    groups = [
+        x_group if isinstance(x_group, LineSet) else LineSet.from_lines(x_group, image_height=height)
+        for slope_group in grouped_lines.values()
+        for x_group in slope_group.values()
+    ]
+    if len(groups) < 1:
+        return []
+    points = np.concatenate([group.points for group in groups])
+    group_ids = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+
+    merged = merge_line_groups(points, group_ids, height, width)
+    merged_lines = [Line(*row, image_height=height) for row in merged]
 
     merged_lines.sort(key=lambda x: x.x_intercept)  # sort by x_intercept
     return merged_lines
@@ -332,21 +594,135 @@ def pixels_between(
     - p2 (tuple[int, int]): the second point
 
     ### Returns
-    - float: the average color value between the two points
+    - float: the average color value between the two points, or 255 if they are 5 pixels apart or less
     """
-    # we will index by pixels, so make sure they are within the confines of the image
-    # print(p1)
-    # print(p2)
-    x_list = np.clip([p1[0], p2[0]], 0, img.shape[1] - 1)
-    y_list = np.clip([p1[1], p2[1]], 0, img.shape[0] - 1)
-    x_list.sort()
-    y_list.sort()
-    line = Line(x_list[0], y_list[0], x_list[1], y_list[1])
-    if line.length() > 5:
-        rr, cc = line.pixels_between()
-        average_value = np.average(img[cc, rr])
-        return average_value
-    return 255 # if the gap 
+    return float(pixels_between_batch(img, np.array([p1]), np.array([p2]))[0])
+
+
+def pixels_between_batch(
+    img: npt.NDArray[any],
+    p1: npt.ArrayLike,
+    p2: npt.ArrayLike,
+    samples: int = None,
+    integral: npt.NDArray[any] = None,
+) -> npt.NDArray[np.float64]:
+    """Returns the average color of the pixels between many pairs of points, in one call. Each pair is treated like `pixels_between`: the points are clipped to the image, and the segment runs from (min x, min y) to (max x, max y).
+
+    ### Parameters
+    - img (npt.NDArray[any]): the image, assumed to be single channel (black and white)
+    - p1 (npt.ArrayLike): (K, 2) array of first points
+    - p2 (npt.ArrayLike): (K, 2) array of second points
+    - samples (int, optional): the number of evenly spaced points to average along each segment. If None, every pixel on the segment is used, exactly like `pixels_between`. Defaults to None.
+    - integral (npt.NDArray[any], optional): the integral image of `img`, i.e. `cv2.integral(img)`. If given, horizontal and vertical segments are averaged from it in O(1) each. Defaults to None.
+
+    ### Returns
+    - npt.NDArray[np.float64]: the average color value between each pair of points, or 255 for pairs 5 pixels apart or less
+    """
+    # we will index by pixels, so make sure they are within the confines of the image.
+    # points is (K, 2 points, [x, y]), sorting it sorts the x and y coordinates separately
+    points = np.stack([np.reshape(p1, (-1, 2)), np.reshape(p2, (-1, 2))], axis=1).astype(np.int32)
+    np.clip(points, 0, [img.shape[1] - 1, img.shape[0] - 1], out=points)
+    points.sort(axis=1)
+    x0, y0 = points[:, 0, 0], points[:, 0, 1]
+    dx, dy = points[:, 1, 0] - x0, points[:, 1, 1] - y0
+
+    averages = np.full(len(points), 255.0)
+    remaining = dx * dx + dy * dy > 25  # segments longer than 5 pixels
+    if integral is not None:
+        spans = remaining & ((dx == 0) | (dy == 0))
+        averages[spans] = _integral_means(integral, x0[spans], y0[spans], dx[spans], dy[spans])
+        remaining &= ~spans
+    if not remaining.any():
+        return averages
+
+    x0, y0, dx, dy = x0[remaining], y0[remaining], dx[remaining], dy[remaining]
+    if samples is None:
+        averages[remaining] = _raster_means(img, x0, y0, dx, dy)
+    else:
+        averages[remaining] = _sampled_means(img, x0, y0, dx, dy, samples)
+    return averages
+
+
+def _raster_means(img, x0, y0, dx, dy) -> npt.NDArray[np.float64]:
+    """The average of every pixel on each segment, rasterized with the same pixels as `skimage.draw.line`. All segments are generated and averaged in a single pass."""
+    # Bresenham: step along the major axis, the minor axis is rounded half up. With
+    # (2 * d * i + steps) // (2 * steps), the major axis (d == steps) comes out as i.
+    steps = np.maximum(dx, dy)
+    counts = steps + 1
+    offsets = np.cumsum(counts) - counts
+    segment = np.repeat(np.arange(len(steps)), counts)
+    i = np.arange(counts.sum()) - offsets[segment]
+    half = steps[segment]
+    xs = x0[segment] + (2 * dx[segment] * i + half) // (2 * half)
+    ys = y0[segment] + (2 * dy[segment] * i + half) // (2 * half)
+
+    values = img.ravel()[ys * img.shape[1] + xs]
+    return np.add.reduceat(values, offsets, dtype=np.int64) / counts
+
+
+def _sampled_means(img, x0, y0, dx, dy, samples: int) -> npt.NDArray[np.float64]:
+    """The average of `samples` evenly spaced pixels along each segment, gathered as one (K, samples) array."""
+    t = np.linspace(0, 1, samples)
+    xs = x0[:, None] + np.rint(t * dx[:, None]).astype(np.int32)
+    ys = y0[:, None] + np.rint(t * dy[:, None]).astype(np.int32)
+    return img[ys, xs].mean(axis=1)
+
+
+def _integral_means(integral, x0, y0, dx, dy) -> npt.NDArray[np.float64]:
+    """The average of horizontal or vertical segments, from four lookups each into the integral image."""
+    x1, y1 = x0 + dx + 1, y0 + dy + 1
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return sums / ((dx + 1) * (dy + 1))
+
+
+def _window_pairs(values: npt.NDArray[any], tolerance: float) -> npt.NDArray[np.int_]:
+    """Finds every pair (i, j), i < j, with |values[i] - values[j]| < tolerance, by sorting the values and only looking inside the tolerance window.
+
+    ### Parameters
+    - values (npt.NDArray[any]): the values to compare
+    - tolerance (float): the maximum distance between a pair
+
+    ### Returns
+    - npt.NDArray[np.int_]: (P, 2) array of index pairs
+    """
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    # for each element, the end of its window in the sorted values
+    starts = np.arange(1, len(values) + 1)
+    ends = np.searchsorted(sorted_values, sorted_values + tolerance, side="left")
+    counts = np.maximum(ends - starts, 0)
+    first = np.repeat(np.arange(len(values)), counts)
+    second = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + starts[first]
+    pairs = np.stack([order[first], order[second]], axis=1)
+    pairs.sort(axis=1)
+    return pairs
+
+
+def lane_candidates(
+    lines: list[Line], x_tolerance: int = 300, y_tolerance: int = 300
+) -> npt.NDArray[np.int_]:
+    """The pairs of lines that could be a lane, i.e. with x-intercepts within `x_tolerance` or y-intercepts within `y_tolerance` of each other.
+
+    ### Parameters
+    - lines (list[Line]): the list of lines to pair up
+    - x_tolerance (int): the maximum difference in x-intercepts in which two lines could be a pair. Defaults to 300 pixels.
+    - y_tolerance (int): the maximum difference in y-intercepts in which two lines could be a pair. Defaults to 300 pixels.
+
+    ### Returns
+    - npt.NDArray[np.int_]: (P, 2) array of index pairs (i, j), i < j, in the same order as `itertools.combinations`
+    """
+    n = len(lines)
+    if n < 2:
+        return np.empty((0, 2), dtype=np.int_)
+    x_intercepts = np.array([line.x_intercept for line in lines], dtype=float)
+    y_intercepts = np.array([line.y_intercept for line in lines], dtype=float)
+    pairs = np.concatenate(
+        [_window_pairs(x_intercepts, x_tolerance), _window_pairs(y_intercepts, y_tolerance)]
+    )
+    # pairs in both windows only count once, and are sorted like combinations(lines, 2)
+    keys = np.unique(pairs[:, 0] * n + pairs[:, 1])
+    return np.stack([keys // n, keys % n], axis=1)
+
 
 def detect_lanes(
     img: npt.NDArray[any],
@@ -354,6 +730,8 @@ def detect_lanes(
     x_tolerance: int = 300,
     y_tolerance: int = 300,
     darkness_threshold: float = 10.0,
+    samples: int = None,
+    integral: npt.NDArray[any] = None,
 ) -> list[tuple[Line, Line]]:
     """Detects the lanes, or pairs of lines, within the given set of lines. Requires the image in order to check for pixels between potential pairs.
 
@@ -363,6 +741,8 @@ def detect_lanes(
     - x_tolerance (int): the maximum difference in x-intercepts in which two lines could be a pair. Defaults to 300 pixels.
     - y_tolerance (int): the maximum difference in y-intercepts in which two lines could be a pair. Defaults to 300 pixels.
     - darkness_threshold (float): the maximum average value of pixels between the two lines for them to be considered a lane. Defaults to 10.0.
+    - samples (int, optional): passed to `pixels_between_batch`, the number of points to check between each pair. Defaults to None (every pixel).
+    - integral (npt.NDArray[any], optional): passed to `pixels_between_batch`, the integral image of `img`. Defaults to None.
 
     ### Returns
     - list[tuple[Line, Line]]: the list of paired lines, or lanes
@@ -370,24 +750,32 @@ def detect_lanes(
     lanes = []  # the return list
     lines.sort(key=lambda x: x.x_intercept)
 
-    for line1, line2 in combinations(lines, 2):
-        # for each unique pair of lines
-        if line1.is_paired() or line2.is_paired():
-            # If either line has a pair, we can't pair it again
-            continue
-        if (
-            dist(line1.x_intercept, line2.x_intercept) < x_tolerance
-            or dist(line1.y_intercept, line2.y_intercept) < y_tolerance
-        ):
-            # (line1, line2) is a fair candidate for a lane.
-            # Next, check the pixels between the lines to see if it is dark.
-            if (
-                pixels_between(img, (line1.x1, line1.y1), (line2.x1, line2.y1))
-                < darkness_threshold
-            ):
-                # The pixels between the lines are dark, so it is a lane.
-                line1.paired = True
-                line2.paired = True
-                lanes.append((line1, line2))
+    # Only pairs inside the intercept windows are fair candidates for a lane.
+    candidates = lane_candidates(lines, x_tolerance, y_tolerance)
+
+    # Check the pixels between the candidates to see if they are dark. This is done in
+    # chunks, so that candidates using an already paired line are rarely checked. The
+    # chunks stay small while lanes are being found, and grow while they are not.
+    starts = np.array([[line.x1, line.y1] for line in lines]).reshape(-1, 2)
+    paired = np.array([line.is_paired() for line in lines], dtype=bool)
+    chunk_size = MIN_LANE_CHUNK
+    while len(candidates) > 0:
+        # If either line has a pair, we can't pair it again
+        candidates = candidates[~(paired[candidates[:, 0]] | paired[candidates[:, 1]])]
+        chunk, candidates = candidates[:chunk_size], candidates[chunk_size:]
+        darkness = pixels_between_batch(
+            img, starts[chunk[:, 0]], starts[chunk[:, 1]], samples=samples, integral=integral
+        )
+
+        chunk_size *= 2
+        for i, j in chunk[darkness < darkness_threshold]:
+            if paired[i] or paired[j]:
+                continue
+            # The pixels between the lines are dark, so it is a lane.
+            paired[i] = paired[j] = True
+            lines[i].paired = True
+            lines[j].paired = True
+            lanes.append((lines[i], lines[j]))
+            chunk_size = MIN_LANE_CHUNK
 
     return lanes
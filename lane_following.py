@@ -24,6 +24,7 @@ def merge_lane_lines(lanes: list[tuple[Line, Line]], height: int) -> list[Line]:
                 height,
                 (lane[0].x(0) + lane[1].x(0)) / 2,
                 0,
+                image_height=height,
             )
         )
     return center_lines
@@ -0,0 +1,118 @@
+from lane_detection import *
+from lane_following import *
+
+# CONSTANTS
+# Pixel based parameters of the lane pipeline, given at full resolution. They are
+# multiplied by the scale of the Preprocessor before use.
+HOUGH_THRESHOLD = 100
+MIN_LINE_LENGTH = 100
+MAX_LINE_GAP = 20
+SLOPE_TOLERANCE = 0.1
+X_INTERCEPT_TOLERANCE = 50
+LANE_X_TOLERANCE = 500
+LANE_Y_TOLERANCE = 200
+DARKNESS_THRESHOLD = 10
+
+# one shared Preprocessor per scale, see shared_preprocessor
+shared_preprocessors = {}
+
+
+def shared_preprocessor(scale: float = 1.0) -> Preprocessor:
+    """The Preprocessor shared by every caller that doesn't bring its own, for the given scale. Shared preprocessors are not thread safe.
+
+    ### Parameters
+    - scale (float, optional): the scale to preprocess frames at. Defaults to 1.0.
+
+    ### Returns
+    - Preprocessor: the shared preprocessor
+    """
+    if scale not in shared_preprocessors:
+        shared_preprocessors[scale] = Preprocessor(scale=scale)
+    return shared_preprocessors[scale]
+
+
+def find_frame_lanes(
+    frame: npt.NDArray[any], preprocessor: Preprocessor = None
+) -> Union[list[tuple[Line, Line]], None]:
+    """Finds the lanes in the bottom half of a frame: preprocessing, line detection, grouping, merging and pairing.
+
+    Every stage runs at the scale of `preprocessor`. Its pixel based parameters are scaled to match, and the lanes are mapped back to full resolution coordinates.
+
+    ### Parameters
+    - frame (npt.NDArray[any]): the full BGR frame
+    - preprocessor (Preprocessor, optional): the preprocessor to filter the frame with. Defaults to `shared_preprocessor()`.
+
+    ### Returns
+    - list[tuple[Line, Line]] | None: the lanes in the split frame, or None if fewer than two lines were found
+    """
+    if preprocessor is None:
+        preprocessor = shared_preprocessor()
+    scale = preprocessor.scale
+    full_height = split(frame).shape[0]
+
+    bw, edges = preprocessor(frame)
+    height = bw.shape[0]
+    width = bw.shape[1]
+
+    # Edge/line detection
+    with latency.stage("find_lines") as timer:
+        lines = find_lines(
+            edges,
+            threshold=max(1, round(HOUGH_THRESHOLD * scale)),
+            min_line_length=MIN_LINE_LENGTH * scale,
+            max_line_gap=MAX_LINE_GAP * scale,
+        )
+        timer.set_count(len(lines))
+    if len(lines) < 2:
+        return None
+    with latency.stage("group_lines") as timer:
+        grouped_lines = group_lines(
+            lines,
+            height,
+            slope_tolerance=SLOPE_TOLERANCE,
+            x_intercept_tolerance=X_INTERCEPT_TOLERANCE * scale,
+        )  # group lines
+        timer.set_count(sum(len(groups) for groups in grouped_lines.values()))
+    with latency.stage("merge_lines") as timer:
+        merged_lines = merge_lines(grouped_lines, height, width)  # merge groups of lines
+        timer.set_count(len(merged_lines))
+
+    # Lane Detection
+    with latency.stage("detect_lanes") as timer:
+        lanes = detect_lanes(
+            bw,
+            merged_lines,
+            LANE_X_TOLERANCE * scale,
+            LANE_Y_TOLERANCE * scale,
+            DARKNESS_THRESHOLD,
+        )
+        timer.set_count(len(lanes))
+    if scale != 1:
+        lanes = [
+            (line1.scaled(1 / scale, full_height), line2.scaled(1 / scale, full_height))
+            for line1, line2 in lanes
+        ]
+    return lanes
+
+
+def find_center_line(
+    frame: npt.NDArray[any], preprocessor: Preprocessor = None
+) -> Union[tuple[Line, list[tuple[Line, Line]]], None]:
+    """Finds the center line of the lane closest to the middle of a frame, in full resolution coordinates.
+
+    ### Parameters
+    - frame (npt.NDArray[any]): the full BGR frame
+    - preprocessor (Preprocessor, optional): the preprocessor to filter the frame with, which also sets the scale. Defaults to `shared_preprocessor()`.
+
+    ### Returns
+    - tuple[Line, list[tuple[Line, Line]]] | None: (center_line, lanes), where center_line is None if no lanes were found. None if fewer than two lines were found.
+    """
+    lanes = find_frame_lanes(frame, preprocessor)
+    if lanes is None:
+        return None
+    height, width = split(frame).shape[:2]
+    with latency.stage("merge_lane_lines"):
+        center_lines = merge_lane_lines(lanes, height)  # find the center of each lane
+    with latency.stage("pick_center_line"):
+        center_line = pick_center_line(center_lines, width)  # find the closest lane
+    return (center_line, lanes)
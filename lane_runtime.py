@@ -0,0 +1,299 @@
+"""
+Live lane following: frames from the AUV, through the lane pipeline, to PID outputs at a fixed rate
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+
+from control_loop import *
+from load_shedding import *
+from lane_tracking import *
+from pid_from_frame import errors_from_frame
+from replay import ReplayVideo
+
+# CONSTANTS
+AXES = ("longitudinal", "lateral", "yaw")  # the order of the errors and outputs
+GAINS = {"K_p": 0.1, "K_i": 0.0, "K_d": 0.0, "integral_limit": 100}
+FRAME_INTERVAL = 1 / 30  # the time between frames from the AUV, in seconds
+# the mailbox already skips the frames the vision thread is too slow for, and nothing is drawn here,
+# so only making each frame cheaper helps
+RUNTIME_LEVELS = ("full", "low_resolution", "tracker_only")
+
+
+def print_sink(outputs, timestamp):
+    """An output sink that prints each tick's outputs, for testing without a vehicle."""
+    print(f"{timestamp:.3f} " + " ".join(f"{axis}={output:+.2f}" for axis, output in zip(AXES, outputs)))
+
+
+class UDPSink:
+    """An output sink that sends each tick's outputs as one JSON datagram, e.g. to the process that drives the thrusters:
+
+        {"time": 12.345, "longitudinal": 0.0, "lateral": 1.2, "yaw": -0.3}
+    """
+
+    def __init__(self, host="127.0.0.1", port=5700):
+        """Opens the socket.
+
+        Args:
+            host (str, optional): the address to send to
+            port (int, optional): the port to send to
+        """
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, outputs, timestamp):
+        message = {"time": timestamp}
+        message.update((axis, float(output)) for axis, output in zip(AXES, outputs))
+        self.socket.sendto(json.dumps(message).encode(), self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+class LaneRuntime:
+    """Follows the lane in a live video source, and drives a sink with PID outputs at a fixed rate.
+
+    Three threads hand work to each other, each keeping only the newest item, so that no stage ever works on stale data: the source receives frames into its mailbox (GStreamer's thread, for a direct_from_auv.Video), the vision thread takes the newest frame and finds the lane errors in it, and the ControlLoop thread updates the PIDs from the newest errors and calls the sink. Frames that arrive while the vision thread is busy are overwritten, and counted. With a LoadShedder, the vision thread detects at a lower scale, or only tracks the lane, while frames take longer than its deadline, so that the control loop keeps getting fresh errors.
+
+    Attributes:
+        source (FrameMailbox): where frames come from
+        control (ControlLoop): the PIDs and the thread that updates them
+        processed_frames (int): the number of frames the lane pipeline ran on
+        lane_frames (int): the number of those frames a lane was found in
+        shedder (LoadShedder): what decides how much load to shed, or None
+        error (BaseException): what stopped the vision thread, if it failed
+    """
+
+    def __init__(
+        self,
+        source,
+        sink=print_sink,
+        rate=50.0,
+        scale=0.5,
+        track=True,
+        stale_after=0.5,
+        stale_policy="decay",
+        gains=GAINS,
+        shedder: LoadShedder = None,
+    ):
+        """Constructs a LaneRuntime. Threads start with `start`.
+
+        Args:
+            source (FrameMailbox): the video source, e.g. a direct_from_auv.Video. Its timestamps must be `time.monotonic` seconds.
+            sink (callable, optional): called with the (longitudinal, lateral, yaw) outputs and the time of each control tick
+            rate (float, optional): the control ticks per second
+            scale (float, optional): the scale to detect lanes at
+            track (bool, optional): whether to track the lane between frames with a LaneTracker
+            stale_after (float, optional): how old the newest lane may be before the outputs stop following it, in seconds
+            stale_policy (str, optional): 'hold', 'decay' or 'zero', see ControlLoop
+            gains (dict, optional): the PIDBank gains of every axis
+            shedder (LoadShedder, optional): sheds load while frames take too long, e.g. LoadShedder(FRAME_INTERVAL, RUNTIME_LEVELS). Defaults to never shedding.
+        """
+        self.source = source
+        self.track = track
+        self.shedder = shedder
+        self.preprocessor = Preprocessor(scale=scale)
+        self.low_preprocessor = Preprocessor(scale=scale * shedder.low_scale if shedder else scale)
+        # the tracker is also used without `track` at the 'tracker_only' level
+        self.tracker = LaneTracker(self.preprocessor)
+        self._redetect_every = self.tracker.redetect_every
+        self.control = ControlLoop(
+            PIDBank(len(AXES), **gains), rate=rate, stale_after=stale_after, stale_policy=stale_policy, sink=sink
+        )
+
+        self.processed_frames = 0
+        self.lane_frames = 0
+        self.error = None
+        self._vision_seconds = 0.0
+        self._latency = []  # the time from receiving each frame to measuring its errors, in seconds
+        self._stopping = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        """Starts the vision and control threads."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._run_vision, daemon=True)
+            self._thread.start()
+            self.control.start()
+        return self
+
+    def stop(self):
+        """Stops the vision and control threads. The source is left running."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.control.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def running(self) -> bool:
+        """Whether the vision thread is still running, and the source has frames left. Only replays run out of frames."""
+        if getattr(self.source, "finished", False) and not self.source.frame_available():
+            return False
+        return self._thread is not None and self._thread.is_alive()
+
+    def report(self) -> dict:
+        """Counts of the frames received, processed and dropped, and of the control ticks.
+
+        Returns:
+            dict: the counters, and the vision rate and latency
+        """
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        latency = np.array(self._latency[-1000:]) * 1000
+        report = {
+            "seconds": elapsed,
+            "received_frames": self.source.frame_count,
+            "processed_frames": self.processed_frames,
+            "lane_frames": self.lane_frames,
+            "overwritten_frames": self.source.overwritten_frames,
+            "dropped_frames": self.source.dropped_frames,
+            "vision_per_sec": self.processed_frames / elapsed if elapsed > 0 else 0.0,
+            "vision_ms": 1000 * self._vision_seconds / self.processed_frames if self.processed_frames else 0.0,
+            "latency_p50_ms": float(np.percentile(latency, 50)) if len(latency) else 0.0,
+            "latency_max_ms": float(latency.max()) if len(latency) else 0.0,
+            "control_ticks": self.control.ticks,
+            "stale_ticks": self.control.stale_ticks,
+            "control_overruns": self.control.overruns,
+        }
+        if self.shedder is not None:
+            report["shed_level"] = self.shedder.level_name
+            report["shed_level_changes"] = self.shedder.level_changes
+        return report
+
+    def format_report(self) -> str:
+        """The report as one line."""
+        report = self.report()
+        line = (
+            f"{report['seconds']:.0f} s: received {report['received_frames']}, processed {report['processed_frames']}"
+            f" ({report['lane_frames']} with a lane, {report['vision_per_sec']:.1f}/sec, {report['vision_ms']:.1f} ms each),"
+            f" overwritten {report['overwritten_frames']}, dropped {report['dropped_frames']};"
+            f" frame to errors p50 {report['latency_p50_ms']:.1f} ms, max {report['latency_max_ms']:.1f} ms;"
+            f" {report['control_ticks']} control ticks, {report['stale_ticks']} stale, {report['control_overruns']} overruns"
+        )
+        if self.shedder is not None:
+            line += (
+                f"; shedding at {report['shed_level']}, {report['shed_level_changes']} level changes"
+            )
+        return line
+
+    def _run_vision(self):
+        try:
+            while not self._stopping.is_set():
+                frame = self.source.wait_frame(timeout=0.1)
+                if frame is None:
+                    continue
+                if self.shedder is not None and not self.shedder.should_process():
+                    continue
+                timestamp = self.source.latest_timestamp
+                start = time.monotonic()
+                errors = errors_from_frame(frame, self._preprocessor(), tracker=self._tracker())
+                now = time.monotonic()
+                self._vision_seconds += now - start
+                self.processed_frames += 1
+                if self.shedder is not None:
+                    self.shedder.record(now - start)
+                if errors is not None:
+                    self.control.measure(errors, timestamp)
+                    self.lane_frames += 1
+                    self._latency.append(now - timestamp)
+                    if len(self._latency) > 10000:
+                        del self._latency[:5000]
+        except BaseException as error:
+            self.error = error
+
+    def _preprocessor(self):
+        """The preprocessor for the current shedding level."""
+        if self.shedder is not None and self.shedder.at_least("low_resolution"):
+            return self.low_preprocessor
+        return self.preprocessor
+
+    def _tracker(self):
+        """The tracker for the current shedding level, set up to match it, or None to detect from scratch."""
+        tracker_only = self.shedder is not None and self.shedder.tracker_only
+        if not (self.track or tracker_only):
+            return None
+        self.tracker.preprocessor = self._preprocessor()
+        self.tracker.redetect_every = sys.maxsize if tracker_only else self._redetect_every
+        return self.tracker
+
+
+def run(runtime: LaneRuntime, duration=None, report_every=5.0):
+    """Runs a runtime until it fails, its source runs out, `duration` passes, or Ctrl-C, printing its report every `report_every` seconds.
+
+    Args:
+        runtime (LaneRuntime): the runtime to run
+        duration (float, optional): how long to run for, in seconds. Defaults to forever.
+        report_every (float, optional): the time between reports, in seconds
+
+    Returns:
+        dict: the final report
+    """
+    end = time.monotonic() + duration if duration is not None else None
+    next_report = time.monotonic() + report_every
+    with runtime:
+        try:
+            while runtime.running() and (end is None or time.monotonic() < end):
+                time.sleep(0.1)
+                if time.monotonic() >= next_report:
+                    print(runtime.format_report(), file=sys.stderr)
+                    next_report += report_every
+        except KeyboardInterrupt:
+            pass
+    if runtime.error is not None:
+        raise RuntimeError("the vision thread failed") from runtime.error
+    print(runtime.format_report(), file=sys.stderr)
+    return runtime.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow the lane in the live video from the AUV")
+    parser.add_argument("--port", type=int, default=5600, help="the UDP port the video arrives on")
+    parser.add_argument("--buffer-mode", type=str, default="copy", choices=("copy", "mapped", "pool"))
+    parser.add_argument("--rate", type=float, default=50.0, help="the control ticks per second")
+    parser.add_argument("--scale", type=float, default=0.5, help="the scale to detect lanes at")
+    parser.add_argument("--no-track", action="store_true", help="detect the lane from scratch in every frame")
+    parser.add_argument("--udp", type=str, default=None, help="send the outputs to this host:port instead of printing them")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--deadline", type=float, default=FRAME_INTERVAL, help="shed load while frames take longer than this, in seconds")
+    parser.add_argument("--no-shed", action="store_true", help="never shed load")
+    parser.add_argument("--replay", type=str, default=None, help="play this video file or directory of images instead of the live video")
+    parser.add_argument("--speed", type=float, default=1.0, help="how many times faster than recorded to replay, 0 for as fast as possible")
+    parser.add_argument("--lockstep", action="store_true", help="process every replayed frame, rather than only the newest")
+    args = parser.parse_args()
+
+    sink = print_sink
+    if args.udp:
+        host, port = args.udp.rsplit(":", 1)
+        sink = UDPSink(host, int(port))
+    if args.replay:
+        source = ReplayVideo(args.replay, args.speed, lockstep=args.lockstep)
+    else:
+        # GStreamer is only needed for the live source
+        from direct_from_auv import Video
+
+        source = Video(port=args.port, buffer_mode=args.buffer_mode)
+    shedder = None if args.no_shed else LoadShedder(args.deadline, RUNTIME_LEVELS)
+    runtime = LaneRuntime(source, sink, rate=args.rate, scale=args.scale, track=not args.no_track, shedder=shedder)
+    try:
+        run(runtime, args.duration)
+    finally:
+        if isinstance(sink, UDPSink):
+            sink.close()
+        if isinstance(source, ReplayVideo):
+            source.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from lane_pipeline import *
+
+
+class LaneTracker:
+    """Follows a lane from frame to frame, so that the full lane pipeline only has to run when the lane is lost.
+
+    A lane is a dark stripe between two lines. On each frame, a few rows of a narrow band around the previous lane are blurred and thresholded like `Preprocessor` does, and the edges of the dark stripe are found again in each row. If enough rows agree with the previous lane, the two lines are refit through the new edges (a hit). Otherwise, or every `redetect_every` frames, `find_frame_lanes` runs on the whole frame (a miss).
+    """
+
+    def __init__(
+        self,
+        preprocessor: Preprocessor = None,
+        redetect_every: int = 30,
+        margin: int = 40,
+        rows: int = 8,
+        min_rows: int = 4,
+    ):
+        """Constructs a LaneTracker.
+
+        ### Parameters
+        - preprocessor (Preprocessor, optional): the preprocessor for full detections, which also sets their scale. Its blur kernel size and threshold are used for the band too. Defaults to `shared_preprocessor()`.
+        - redetect_every (int, optional): the most frames in a row that are tracked before a full detection is forced. Defaults to 30.
+        - margin (int, optional): how far, in full resolution pixels, each line may move between frames. Defaults to 40.
+        - rows (int, optional): the number of rows checked in the band. Defaults to 8.
+        - min_rows (int, optional): the number of rows that must find the lane for it to be tracked. Defaults to 4.
+        """
+        self.preprocessor = preprocessor if preprocessor is not None else shared_preprocessor()
+        self.redetect_every = redetect_every
+        self.margin = margin
+        self.rows = rows
+        self.min_rows = min_rows
+        self.reset()
+
+    def reset(self):
+        """Forgets the tracked lane and resets the counters."""
+        self.lane = None
+        self.center_line = None
+        self.tracked_frames = 0
+        self.hits = 0
+        self.misses = 0
+
+    def update(
+        self, frame: npt.NDArray[any]
+    ) -> Union[tuple[Line, list[tuple[Line, Line]]], None]:
+        """Finds the center line in a new frame, tracking the previous lane if possible.
+
+        ### Parameters
+        - frame (npt.NDArray[any]): the full BGR frame
+
+        ### Returns
+        - tuple[Line, list[tuple[Line, Line]]] | None: the same as `find_center_line`, (center_line, lanes). When the lane was tracked, lanes only holds the tracked lane.
+        """
+        sliced = split(frame)
+        height, width = sliced.shape[:2]
+
+        if self.lane is not None and self.tracked_frames < self.redetect_every:
+            with latency.stage("track") as timer:
+                lane = self.track(sliced)
+                timer.set_count(0 if lane is None else 1)
+            if lane is not None:
+                self.hits += 1
+                self.tracked_frames += 1
+                self.lane = lane
+                self.center_line = merge_lane_lines([lane], height)[0]
+                return (self.center_line, [lane])
+
+        self.misses += 1
+        self.tracked_frames = 0
+        lanes = find_frame_lanes(frame, self.preprocessor)
+        if lanes is None:
+            self.lane = self.center_line = None
+            return None
+
+        with latency.stage("merge_lane_lines"):
+            center_lines = merge_lane_lines(lanes, height)  # find the center of each lane
+        with latency.stage("pick_center_line"):
+            self.center_line = pick_center_line(center_lines, width)  # find the closest lane
+        if self.center_line is None:
+            self.lane = None
+        else:
+            self.lane = lanes[center_lines.index(self.center_line)]
+        return (self.center_line, lanes)
+
+    def track(self, sliced: npt.NDArray[any]) -> Union[tuple[Line, Line], None]:
+        """Looks for the previous lane in a band around it.
+
+        ### Parameters
+        - sliced (npt.NDArray[any]): the bottom half of the frame, in BGR
+
+        ### Returns
+        - tuple[Line, Line] | None: the refit lane, or None if it could not be found
+        """
+        height, width = sliced.shape[:2]
+        kernel_size = self.preprocessor.kernel_size
+        half_kernel = kernel_size // 2
+
+        ys, lefts, rights = [], [], []
+        for y in np.linspace(half_kernel, height - 1 - half_kernel, self.rows).astype(int):
+            # where the previous lines cross this row
+            x1, x2 = sorted((self.lane[0].x(y), self.lane[1].x(y)))
+            if not (0 <= x1 and x2 < width):
+                continue
+            lo = max(0, int(x1) - self.margin - half_kernel)
+            hi = min(width, int(x2) + self.margin + half_kernel + 1)
+
+            # blur a band as tall as the kernel, so that its middle row matches the full pipeline
+            band = to_gray(sliced[y - half_kernel : y + half_kernel + 1, lo:hi])
+            row = to_blurred(band, kernel_size)[half_kernel]
+            dark = row <= self.preprocessor.t
+
+            # the dark stripe that contains the middle of the previous lane
+            middle = int((x1 + x2) / 2) - lo
+            if not dark[middle]:
+                continue
+            bright = np.flatnonzero(~dark)
+            left_bright, right_bright = bright[bright < middle], bright[bright > middle]
+            if len(left_bright) < 1 or len(right_bright) < 1:
+                continue  # the stripe runs off the band, so its edges are unknown
+            left, right = left_bright[-1] + 1 + lo, right_bright[0] + lo
+            if abs(left - x1) > self.margin or abs(right - x2) > self.margin:
+                continue
+
+            ys.append(y)
+            lefts.append(left)
+            rights.append(right)
+
+        if len(ys) < max(2, self.min_rows):
+            return None
+
+        # refit x = ay + b through each edge, since lane lines are closer to vertical
+        lane = []
+        for xs in (lefts, rights):
+            a, b = np.polyfit(ys, xs, 1)
+            lane.append(Line(a * height + b, height, b, 0, image_height=height))
+        return tuple(lane)
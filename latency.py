@@ -0,0 +1,212 @@
+"""
+Opt-in per-stage latency instrumentation for the lane and tag pipelines
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# the recorder stages are timed into, or None while instrumentation is disabled
+recorder = None
+
+
+class StageTimer:
+    """Times one run of a stage, as a context manager. Use `set_count` to record how many items the stage produced."""
+
+    __slots__ = ("recorder", "name", "start", "count")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.count = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, self.start, time.perf_counter() - self.start, self.count)
+
+    def set_count(self, count):
+        """Records how many items the stage produced, e.g. line segments or tags.
+
+        Args:
+            count (int): the number of items
+        """
+        self.count = count
+
+
+class FrameTimer(StageTimer):
+    """Times a whole frame, and numbers the stages timed on this thread until it ends."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        self.recorder.start_frame()
+        return super().__enter__()
+
+
+class _NullTimer:
+    """Stands in for a StageTimer while instrumentation is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def set_count(self, count):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class LatencyRecorder:
+    """Keeps the most recent stage timings in a ring buffer.
+
+    Each record is (frame, stage, start, seconds, count): the number of the frame it belongs to, the name of the stage, its `time.perf_counter` start time, its wall time in seconds, and the number of items it produced, or None. Frames are numbered by `frame` timers and tracked per thread, so threads can time frames at the same time. A recorder only sees its own process.
+
+    Attributes:
+        records (deque): the most recent records, oldest first
+    """
+
+    def __init__(self, capacity=100000):
+        """Constructs an empty recorder.
+
+        Args:
+            capacity (int, optional): the most records kept. Older ones are discarded.
+        """
+        self.records = deque(maxlen=capacity)
+        self._frames = itertools.count()
+        self._local = threading.local()
+
+    def stage(self, name):
+        """A timer for one run of a stage."""
+        return StageTimer(self, name)
+
+    def frame(self, name="frame"):
+        """A timer for a whole frame, which starts a new frame number on this thread."""
+        return FrameTimer(self, name)
+
+    def start_frame(self):
+        self._local.frame = next(self._frames)
+
+    def record(self, stage, start, seconds, count=None):
+        """Adds a record.
+
+        Args:
+            stage (str): the name of the stage
+            start (float): when the stage started, in `time.perf_counter` seconds
+            seconds (float): how long the stage took
+            count (int, optional): the number of items the stage produced
+        """
+        self.records.append((getattr(self._local, "frame", None), stage, start, seconds, count))
+
+    def clear(self):
+        """Discards every record."""
+        self.records.clear()
+
+    def summary(self):
+        """Latency percentiles of each stage, over the records kept.
+
+        Returns:
+            dict: for each stage, the number of calls, the p50, p95, p99, mean and max wall time in milliseconds, and the mean count if the stage records counts
+        """
+        seconds = {}
+        counts = {}
+        for _, stage, _, elapsed, count in list(self.records):
+            seconds.setdefault(stage, []).append(elapsed)
+            if count is not None:
+                counts.setdefault(stage, []).append(count)
+
+        summary = {}
+        for stage, values in seconds.items():
+            milliseconds = 1000 * np.array(values)
+            p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+            summary[stage] = {
+                "calls": len(values),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "mean_ms": float(milliseconds.mean()),
+                "max_ms": float(milliseconds.max()),
+            }
+            if stage in counts:
+                summary[stage]["mean_count"] = float(np.mean(counts[stage]))
+        return summary
+
+    def report(self):
+        """The summary as a table, one stage per line, slowest mean first.
+
+        Returns:
+            str: the table
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<18}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'count':>8}"]
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["mean_ms"]):
+            count = f"{stats['mean_count']:.1f}" if "mean_count" in stats else ""
+            lines.append(
+                f"{stage:<18}{stats['calls']:>7}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+                f"{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}{count:>8}"
+            )
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Writes every record as one JSON object per line.
+
+        Args:
+            path (str): the file to write
+        """
+        with open(path, "w") as file:
+            for frame, stage, start, seconds, count in list(self.records):
+                record = {"frame": frame, "stage": stage, "start": start, "ms": 1000 * seconds}
+                if count is not None:
+                    record["count"] = count
+                file.write(json.dumps(record) + "\n")
+
+
+def enable(capacity=100000):
+    """Starts recording stage timings into a new recorder.
+
+    Args:
+        capacity (int, optional): the most records kept
+
+    Returns:
+        LatencyRecorder: the new recorder
+    """
+    global recorder
+    recorder = LatencyRecorder(capacity)
+    return recorder
+
+
+def disable():
+    """Stops recording stage timings.
+
+    Returns:
+        LatencyRecorder: the recorder that was in use, or None
+    """
+    global recorder
+    previous, recorder = recorder, None
+    return previous
+
+
+def stage(name):
+    """A timer for one run of a stage, which does nothing while instrumentation is disabled:
+
+        with latency.stage("find_lines") as timer:
+            lines = find_lines(edges)
+            timer.set_count(len(lines))
+    """
+    active = recorder
+    return NULL_TIMER if active is None else StageTimer(active, name)
+
+
+def frame(name="frame"):
+    """A timer for a whole frame, which does nothing while instrumentation is disabled."""
+    active = recorder
+    return NULL_TIMER if active is None else FrameTimer(active, name)
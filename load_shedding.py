@@ -0,0 +1,178 @@
+"""
+Load shedding for the vision loop: degrades in steps while frames take longer than their deadline, and recovers when they don't
+"""
+
+# CONSTANTS
+# the levels, from no shedding to the most, each one adding to those before it
+LEVELS = ("full", "skip_frames", "low_resolution", "no_drawing", "tracker_only")
+
+
+class LoadShedder:
+    """Watches how long each frame takes against a deadline, and sheds load in steps when it is missed.
+
+    Each level adds to those before it: 'skip_frames' processes only every `skip_every`-th frame, 'low_resolution' detects lanes at `low_scale` times the usual scale, 'no_drawing' skips drawing and text, and 'tracker_only' stops the lane tracker from forcing full detections while it keeps the lane. Skipping only helps callers that would otherwise process every frame, e.g. a queue of frames; a consumer of a latest-only mailbox already skips the frames it is too slow for, and should leave 'skip_frames' out of its levels. Callers ask `should_process` for each frame, time the frames they process with `record`, and read the other properties to pick how to process them.
+
+    The smoothed time of each processed frame is compared with the deadline, whatever the level: skipping frames spreads the work out, but does not make a frame any cheaper, so it is never a reason to stay at a level. After `degrade_after` frames in a row over the deadline, the level goes up one; after `recover_after` frames in a row under `recover_below` times the deadline, it comes down one. The smoothed time is restarted after every change, so each level is judged on its own frames. Frames are cheaper at a higher level, so a recovery can fail as soon as it is made; each recovery that is undone within `recover_after` frames doubles the frames the next one waits for, up to 16 times, so that the level does not swing back and forth under steady load.
+
+    Attributes:
+        deadline (float): the time each frame may take, in seconds, usually the frame interval
+        levels (tuple[str]): the levels in use, in order, starting with 'full'
+        level (int): the index of the current level
+        mean_seconds (float): the smoothed time of the frames processed at this level, or None
+        frames (int): the number of frames offered
+        skipped_frames (int): the number of those frames skipped
+        level_changes (int): the number of times the level changed
+        level_frames (dict): the number of frames offered at each level, by name
+    """
+
+    def __init__(
+        self,
+        deadline,
+        levels=LEVELS,
+        skip_every=2,
+        low_scale=0.5,
+        smoothing=0.3,
+        degrade_after=5,
+        recover_after=30,
+        recover_below=0.7,
+    ):
+        """Constructs a LoadShedder at the 'full' level.
+
+        Args:
+            deadline (float): the time each frame may take, in seconds
+            levels (tuple[str], optional): the levels to use, in order, a subset of LEVELS starting with 'full'. Leave out those that do not apply, e.g. 'no_drawing' where nothing is drawn.
+            skip_every (int, optional): at 'skip_frames' and above, one frame in this many is processed
+            low_scale (float, optional): at 'low_resolution' and above, the factor the detection scale is multiplied by
+            smoothing (float, optional): the weight of the newest frame in the smoothed frame time
+            degrade_after (int, optional): the frames in a row over the deadline before the level goes up
+            recover_after (int, optional): the frames in a row under the deadline before the level comes down
+            recover_below (float, optional): the fraction of the deadline frames must take to recover
+        """
+        if not levels or levels[0] != "full" or any(level not in LEVELS for level in levels):
+            raise ValueError(f"levels must start with 'full' and be some of {LEVELS}")
+        self.deadline = deadline
+        self.levels = tuple(levels)
+        self.skip_every = skip_every
+        self.low_scale = low_scale
+        self.smoothing = smoothing
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.recover_below = recover_below
+
+        self.level = 0
+        self.mean_seconds = None
+        self.frames = 0
+        self.skipped_frames = 0
+        self.level_changes = 0
+        self.level_frames = {level: 0 for level in self.levels}
+        self._over = 0
+        self._under = 0
+        self._recover_wait = recover_after  # the frames under the deadline the next recovery waits for
+        self._recovered = False  # whether the last change was a recovery
+        self._since_change = 0  # the frames processed since the last change
+
+    @property
+    def level_name(self) -> str:
+        """The name of the current level."""
+        return self.levels[self.level]
+
+    def at_least(self, name: str, level: int = None) -> bool:
+        """Whether a level, the current one by default, sheds what `name` does. Levels not in use are never reached."""
+        if level is None:
+            level = self.level
+        return name in self.levels and level >= self.levels.index(name)
+
+    @property
+    def draw(self) -> bool:
+        """Whether to draw onto frames."""
+        return not self.at_least("no_drawing")
+
+    @property
+    def tracker_only(self) -> bool:
+        """Whether the lane tracker should keep tracking without forced full detections."""
+        return self.at_least("tracker_only")
+
+    def scale(self, scale: float = 1.0) -> float:
+        """The scale to detect lanes at.
+
+        Args:
+            scale (float, optional): the scale used when load is not shed
+
+        Returns:
+            float: the scale for the current level
+        """
+        return scale * self.low_scale if self.at_least("low_resolution") else scale
+
+    def should_process(self) -> bool:
+        """Offers a frame. Call once for every frame that arrives.
+
+        Returns:
+            bool: whether to process it, or skip it
+        """
+        self.frames += 1
+        self.level_frames[self.level_name] += 1
+        if self.at_least("skip_frames") and self.frames % self.skip_every != 0:
+            self.skipped_frames += 1
+            return False
+        return True
+
+    def record(self, seconds: float) -> int:
+        """Records how long a processed frame took, and changes the level if it is time to.
+
+        Args:
+            seconds (float): the time the frame took
+
+        Returns:
+            int: the level, after any change
+        """
+        if self.mean_seconds is None:
+            self.mean_seconds = seconds
+        else:
+            self.mean_seconds += self.smoothing * (seconds - self.mean_seconds)
+        self._since_change += 1
+        if self._recovered and self._since_change >= self.recover_after:
+            # the recovery held
+            self._recover_wait = self.recover_after
+            self._recovered = False
+
+        if self.mean_seconds > self.deadline:
+            self._over += 1
+            self._under = 0
+        elif self.level > 0 and self.mean_seconds < self.recover_below * self.deadline:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.degrade_after and self.level < len(self.levels) - 1:
+            if self._recovered:
+                self._recover_wait = min(2 * self._recover_wait, 16 * self.recover_after)
+            self._change(self.level + 1)
+            self._recovered = False
+        elif self._under >= self._recover_wait:
+            self._change(self.level - 1)
+            self._recovered = True
+        return self.level
+
+    def report(self) -> dict:
+        """The level and the frames offered and skipped.
+
+        Returns:
+            dict: the counters
+        """
+        return {
+            "level": self.level,
+            "level_name": self.level_name,
+            "mean_ms": 1000 * self.mean_seconds if self.mean_seconds is not None else None,
+            "frames": self.frames,
+            "skipped_frames": self.skipped_frames,
+            "level_changes": self.level_changes,
+            "level_frames": dict(self.level_frames),
+        }
+
+    def _change(self, level):
+        self.level = level
+        self.level_changes += 1
+        self.mean_seconds = None
+        self._over = self._under = 0
+        self._since_change = 0
@@ -1,28 +1,245 @@
 import argparse
+import asyncio
+import threading
+import time
 
 import cv2
 
+from control_loop import *
+from frame_source import FrameSource
+from lane_runtime import AXES, GAINS, print_sink
+from lane_tracking import *
+from pid_from_frame import errors_from_frame
 
-def main(ip_address):
-    vcap = cv2.VideoCapture(f"rtsp://{ip_address}:8554/rovcam")
 
-    try:
-        while True:
-            # Obtain the frame
-            ret, frame = vcap.read()
+class StreamGrabber:
+    """Keeps a video stream drained on a thread of its own, so that the frame it serves is always the newest one.
+
+    cv2.VideoCapture buffers frames that are not read, so a reader slower than the stream acts on older and older frames. The grabber thread calls `grab()` on every frame as it arrives, which only demuxes and decodes it, and only calls `retrieve()`, which converts it to BGR, when `latest` asks for a frame. If the stream fails, it is reopened, waiting longer after each failed attempt.
+
+    Attributes:
+        uri (str): the stream, e.g. rtsp://<ip>:8554/rovcam
+        grabbed_frames (int): the number of frames grabbed
+        retrieved_frames (int): the number of frames converted for `latest`
+        reconnects (int): the number of times the stream was reopened
+        connected (bool): whether the stream is open
+    """
+
+    def __init__(
+        self,
+        uri,
+        api_preference=cv2.CAP_ANY,
+        reconnect_delay=0.5,
+        max_reconnect_delay=10.0,
+        stale_after=2.0,
+        timeout_ms=5000,
+    ):
+        """Constructs a StreamGrabber. The stream is opened by `start`.
+
+        Args:
+            uri (str): the stream to open
+            api_preference (int, optional): the OpenCV backend
+            reconnect_delay (float, optional): the wait before the first attempt to reopen the stream, in seconds. It doubles after each failed attempt.
+            max_reconnect_delay (float, optional): the longest wait between attempts, in seconds
+            stale_after (float, optional): how long grabs may keep failing before the stream is reopened, in seconds
+            timeout_ms (int, optional): the open and read timeouts passed to OpenCV, in milliseconds
+        """
+        self.uri = uri
+        self.api_preference = api_preference
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.stale_after = stale_after
+        self.timeout_ms = timeout_ms
+
+        self.grabbed_frames = 0
+        self.retrieved_frames = 0
+        self.reconnects = 0
+        self.connected = False
+
+        self._condition = threading.Condition()
+        self._wanted = False  # whether `latest` is waiting for the next grabbed frame
+        self._frame = None
+        self._frame_timestamp = None
+        self._frame_sequence = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the grabber thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the grabber thread and closes the stream."""
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def latest(self, timeout=1.0):
+        """Converts the next frame grabbed, which waits at most one frame interval, and returns it with its age.
+
+        Args:
+            timeout (float, optional): the longest time to wait for a frame, in seconds. If no frame arrives in time, the last converted frame is returned instead.
+
+        Returns:
+            tuple: (frame, age) where age is the time since the frame was grabbed, in seconds, or (None, None) if no frame was converted yet
+        """
+        with self._condition:
+            self._wanted = True
+            self._condition.wait_for(lambda: not self._wanted or self._stopping.is_set(), timeout)
+            self._wanted = False
+            if self._frame is None:
+                return (None, None)
+            return (self._frame, time.monotonic() - self._frame_timestamp)
+
+    def sequence(self):
+        """The sequence number of the frame returned by `latest` last, counting every frame grabbed from 1, or None."""
+        return self._frame_sequence
+
+    def _open(self):
+        params = []
+        for prop, value in (("CAP_PROP_OPEN_TIMEOUT_MSEC", self.timeout_ms), ("CAP_PROP_READ_TIMEOUT_MSEC", self.timeout_ms)):
+            if hasattr(cv2, prop):
+                params += [getattr(cv2, prop), value]
+        capture = cv2.VideoCapture(self.uri, self.api_preference, params)
+        if not capture.isOpened():
+            capture.release()
+            return None
+        # keep OpenCV's own queue as short as the backend allows
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+
+    def _run(self):
+        capture = None
+        delay = self.reconnect_delay
+        last_grab = time.monotonic()
+        while not self._stopping.is_set():
+            if capture is None:
+                capture = self._open()
+                if capture is None:
+                    # wait longer after each failed attempt
+                    self._stopping.wait(delay)
+                    delay = min(2 * delay, self.max_reconnect_delay)
+                    continue
+                self.connected = True
+                last_grab = time.monotonic()
 
-            # Check frame was received successfully
-            if ret:
-                print(" YOU GOT THIS ")
-                print(frame.shape)
-                # TODO: Do something with the frame here
+            if not capture.grab():
+                if time.monotonic() - last_grab > self.stale_after:
+                    capture.release()
+                    capture = None
+                    self.connected = False
+                    self.reconnects += 1
+                else:
+                    self._stopping.wait(0.005)
+                continue
 
-            else:
-                pass
+            last_grab = time.monotonic()
+            delay = self.reconnect_delay
+            self.grabbed_frames += 1
+            with self._condition:
+                if self._wanted:
+                    ret, frame = capture.retrieve()
+                    if ret:
+                        self._frame = frame
+                        self._frame_timestamp = last_grab
+                        self._frame_sequence = self.grabbed_frames
+                        self.retrieved_frames += 1
+                        self._wanted = False
+                        self._condition.notify_all()
 
+        if capture is not None:
+            capture.release()
+        self.connected = False
+
+
+class GrabberSource(FrameSource):
+    """The frames of a StreamGrabber as a FrameSource, so that a stream read by a grabber can be iterated on an event loop. Each frame is yielded once, timestamped when it was grabbed. The source never ends on its own, only when it is closed; the grabber reconnects while it runs."""
+
+    def __init__(self, uri, maxsize=1, policy="drop_oldest", poll_timeout=0.1, **grabber_options):
+        """Wraps a new StreamGrabber. The grabber starts when the source does.
+
+        Args:
+            uri (str): the stream, e.g. rtsp://<ip>:8554/rovcam
+            maxsize (int, optional): the most frames queued at once. The default of 1 keeps only the newest.
+            policy (str, optional): 'block' or 'drop_oldest'
+            poll_timeout (float, optional): how often, in seconds, the reader checks whether the source was closed while no frames arrive
+            **grabber_options: passed to StreamGrabber
+        """
+        super().__init__(maxsize, policy)
+        self.grabber = StreamGrabber(uri, **grabber_options)
+        self.poll_timeout = poll_timeout
+        self._sequence = None
+        self._timestamp = None
+
+    def start(self):
+        self.grabber.start()
+        super().start()
+
+    def read(self):
+        while not self._stopping.is_set():
+            frame, age = self.grabber.latest(timeout=self.poll_timeout)
+            sequence = self.grabber.sequence()
+            if frame is not None and sequence != self._sequence:
+                self._sequence = sequence
+                self._timestamp = time.monotonic() - age
+                return frame
+        return None
+
+    def read_timestamp(self):
+        return self._timestamp
+
+    def release(self):
+        self.grabber.stop()
+
+
+async def follow_lane(source: FrameSource, control: ControlLoop, scale=0.5):
+    """Finds the lane in every frame of a source and passes its errors to a control loop, as a task of the event loop.
+
+    Args:
+        source (FrameSource): where frames come from
+        control (ControlLoop): the PIDs the errors go to
+        scale (float, optional): the scale to detect lanes at
+    """
+    preprocessor = Preprocessor(scale=scale)
+    tracker = LaneTracker(preprocessor)
+    async for frame in source:
+        # OpenCV releases the GIL, so the lane pipeline runs on a worker thread without holding up the loop
+        errors = await asyncio.to_thread(errors_from_frame, frame, preprocessor, tracker=tracker)
+        if errors is not None:
+            control.measure(errors, source.latest_timestamp)
+
+
+async def capture(ip_address, sink=print_sink):
+    """Follows the lane in the RTSP stream, with the lane and control tasks sharing one event loop."""
+    control = ControlLoop(PIDBank(len(AXES), **GAINS), sink=sink)
+    async with GrabberSource(f"rtsp://{ip_address}:8554/rovcam") as source:
+        driver = asyncio.create_task(control.run_async())
+        try:
+            await follow_lane(source, control)
+        finally:
+            driver.cancel()
+    grabber = source.grabber
+    print(f"Grabbed {grabber.grabbed_frames} frames, used {grabber.retrieved_frames}, reconnected {grabber.reconnects} times")
+    print(f"{control.measurements} lane measurements, {control.ticks} control ticks, {control.stale_ticks} stale")
+
+
+def main(ip_address):
+    try:
+        asyncio.run(capture(ip_address))
     except KeyboardInterrupt:
-        # Close the connection
-        vcap.release()
+        pass
 
 
 if __name__ == "__main__":
@@ -48,6 +48,13 @@ class PID:
 
         return output
 
+    def __call__(self, error, error_derivative=None):
+        """Update the PID controller, as `update` does
+        Args:
+            error (float): The current error
+        """
+        return self.update(error, error_derivative)
+
     def _get_integral(self, error, dt):
         """Calculate the integral term
         Args:
@@ -79,4 +86,82 @@ class PID:
         # TODO: Calculate and return the derivative term
         derivative = (error - self.last_error) / dt
 
-        return derivative
\ No newline at end of file
+        return derivative
+
+
+class PIDBank:
+    def __init__(self, size, K_p=0.0, K_i=0.0, K_d=0.0, integral_limit=None, clock=time.monotonic):
+        """Constructor for a bank of `size` independent PID controllers, updated together
+        Args:
+            size (int): The number of controllers
+            K_p (float or array): The proportional gain, of all controllers or of each
+            K_i (float or array): The integral gain, of all controllers or of each
+            K_d (float or array): The derivative gain, of all controllers or of each
+            integral_limit (float or array, optional): The integral limit, of all controllers or of each
+            clock (callable, optional): Returns the current time in seconds. Pass a fake clock to replay recorded errors deterministically.
+        """
+        self.size = size
+        self.K_p = np.broadcast_to(np.asarray(K_p, dtype=float), (size,)).copy()
+        self.K_i = np.broadcast_to(np.asarray(K_i, dtype=float), (size,)).copy()
+        self.K_d = np.broadcast_to(np.asarray(K_d, dtype=float), (size,)).copy()
+        if integral_limit is None:
+            integral_limit = np.inf
+        self.integral_limit = np.broadcast_to(np.asarray(integral_limit, dtype=float), (size,)).copy()
+        self.clock = clock
+
+        self.last_error = np.zeros(size)
+        self.integral = np.zeros(size)
+        self.last_time = np.zeros(size)
+        self.reset()
+
+    def reset(self, indices=None, last_error=0.0, last_time=None):
+        """Reset the PID controllers
+        Args:
+            indices (array, optional): The controllers to reset. Defaults to all of them.
+            last_error (float or array, optional): The error the next update takes its derivative against. Seed it with the current error so that the derivative does not kick.
+            last_time (float, optional): The time the next update measures dt from. Defaults to now.
+        """
+        if indices is None:
+            indices = slice(None)
+        self.last_error[indices] = last_error
+        self.integral[indices] = 0.0
+        self.last_time[indices] = self.clock() if last_time is None else last_time
+
+    def update(self, errors, error_derivatives=None, indices=None):
+        """Update some or all of the PID controllers at once. Each controller behaves like a PID,
+        with its own integral, last error and last update time.
+        Args:
+            errors (array): The current error of each controller updated
+            error_derivatives (array, optional): The derivative of each error. Defaults to the change in error over time.
+            indices (array, optional): The controllers updated, one per error. Defaults to all of them, in order.
+        Returns:
+            np.ndarray: The output of each controller updated. Controllers updated twice at the same time output 0.
+        """
+        if indices is None:
+            indices = np.arange(self.size)
+        else:
+            indices = np.asarray(indices, dtype=int)
+        errors = np.asarray(errors, dtype=float)
+        current_time = self.clock()
+        dt = current_time - self.last_time[indices]
+
+        outputs = np.zeros(len(indices))
+        moving = dt != 0
+        indices, dt, errors = indices[moving], dt[moving], errors[moving]
+
+        self.last_time[indices] = current_time
+        integral = np.clip(
+            self.integral[indices] + errors * dt, -self.integral_limit[indices], self.integral_limit[indices]
+        )
+        self.integral[indices] = integral
+        if error_derivatives is None:
+            derivative = (errors - self.last_error[indices]) / dt
+        else:
+            derivative = np.asarray(error_derivatives, dtype=float)[moving]
+
+        outputs[moving] = (
+            self.K_p[indices] * errors + self.K_i[indices] * integral + self.K_d[indices] * derivative
+        )
+        self.last_error[indices] = errors
+
+        return outputs
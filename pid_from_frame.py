@@ -1,18 +1,65 @@
 from multiprocessing import Process
 
-from lane_detection import *
-from lane_following import *
+from lane_pipeline import *
+from lane_tracking import *
 from pid import *
 
 
-def process_frame(frame, lateral_pid, longitudinal_pid, yaw_pid):
+def errors_from_frame(
+    frame,
+    preprocessor: Preprocessor = None,
+    scale: float = 1.0,
+    tracker: LaneTracker = None,
+):
+    """Finds the lane in a frame and the errors of the AUV relative to its center line.
+
+    ### Parameters
+        frame: the frame to process
+        preprocessor (Preprocessor, optional): the preprocessor to filter the frame with. Defaults to the shared one for `scale`, which is not thread safe.
+        scale (float, optional): the scale to detect lanes at when no preprocessor is given, e.g. 0.5 for half resolution. Defaults to 1.0.
+        tracker (LaneTracker, optional): if given, the lane is tracked from the previous frame instead of detected from scratch. The tracker's own preprocessor is used for full detections. Defaults to None.
+
+    ### Returns
+        (float, float, float): the longitudinal, lateral and yaw errors, or None if no lane was found
+    """
+    if preprocessor is None:
+        preprocessor = shared_preprocessor(scale)
+    width = frame.shape[1]
+
+    with latency.frame():
+        # Process image, edge/line detection and lane picking
+        if tracker is not None:
+            found = tracker.update(frame)
+        else:
+            found = find_center_line(frame, preprocessor)
+        if found is None:
+            return None
+        center_line, lanes = found
+        with latency.stage("error_from_line"):
+            return error_from_line(center_line, width)
+
+
+def process_frame(
+    frame,
+    lateral_pid,
+    longitudinal_pid,
+    yaw_pid,
+    preprocessor: Preprocessor = None,
+    scale: float = 1.0,
+    tracker: LaneTracker = None,
+):
     """Applies a sequence of image filtering and processing to suggest PID movements to center the lane.
 
+    The PIDs are only updated when a frame is processed, so control follows the vision rate; see control_loop.ControlLoop to update them at a fixed rate from `errors_from_frame` instead.
+
     ### Parameters
         frame: the frame to process/render
         lateral_pid (PID): the horizontal PID control object
         longitudinal_pid (PID): the forward/backward PID control object
         yaw_pid (PID): the yaw PID control object
+        preprocessor (Preprocessor, optional): the preprocessor to filter the frame with. Defaults to the shared one for `scale`, which is not thread safe.
+        scale (float, optional): the scale to detect lanes at when no preprocessor is given, e.g. 0.5 for half resolution. Defaults to 1.0.
+        tracker (LaneTracker, optional): if given, the lane is tracked from the previous frame instead of detected from scratch. The tracker's own preprocessor is used for full detections. Defaults to None.
 
     ### Returns
         (float, float, float): the percent outputs for each of longitudinal, lateral, and yaw
@@ -20,37 +67,13 @@ def process_frame(frame, lateral_pid, longitudinal_pid, yaw_pid):
     lateral = 0
     longitudinal = 0
     yaw = 0
-    # Process image
-    sliced = split(frame)
-    height = sliced.shape[0]
-    width = sliced.shape[1]
-    gray = to_gray(sliced)
-    blurred = to_blurred(gray)
-    bw = to_bw(blurred)
-
-    # Edge/line detection
-    edges = find_edges(bw)
-    lines = find_lines(edges)
-    if len(lines) > 1:
-        grouped_lines = group_lines(
-            lines, height, slope_tolerance=0.1, x_intercept_tolerance=50
-        )  # group lines
-        merged_lines = merge_lines(
-            grouped_lines, height, width
-        )  # merge groups of lines
-
-        # Lane Detection
-        lanes = detect_lanes(bw, merged_lines, 500, 200, 10)
-
-        # Lane picking
-        center_lines = merge_lane_lines(lanes, height)  # find the center of each lane
-        center_line = pick_center_line(center_lines, width)  # find the closest lane
-        (longitudinal_error, lateral_error, yaw_error) = error_from_line(
-            center_line, width
-        )
-        
-        longitudinal = longitudinal_pid(longitudinal_error)
-        lateral = lateral_pid(lateral_error)
-        yaw = yaw_pid(yaw_error)
+
+    errors = errors_from_frame(frame, preprocessor, scale, tracker)
+    if errors is not None:
+        (longitudinal_error, lateral_error, yaw_error) = errors
+        with latency.stage("pid"):
+            longitudinal = longitudinal_pid(longitudinal_error)
+            lateral = lateral_pid(lateral_error)
+            yaw = yaw_pid(yaw_error)
 
     return (longitudinal, lateral, yaw)
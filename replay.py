@@ -0,0 +1,244 @@
+"""
+Replays recorded video through the direct_from_auv.Video interface, or over UDP as the AUV streams it
+"""
+
+import argparse
+import glob
+import os
+import re
+import threading
+import time
+
+import cv2
+
+from frame_mailbox import FrameMailbox
+
+# CONSTANTS
+FRAMES_FPS = 30  # the rate a directory of images is played at, unless told otherwise
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# encodes frames the way the AUV's camera does, for direct_from_auv.Video to receive
+PUSH_PIPELINE = (
+    "appsrc ! videoconvert ! video/x-raw,format=I420"
+    " ! x264enc tune=zerolatency speed-preset=ultrafast key-int-max={key_interval}"
+    " ! rtph264pay config-interval=1 pt=96 ! udpsink host={host} port={port} sync=false"
+)
+
+
+def natural_key(path):
+    """Sorts frame10.jpg after frame9.jpg."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def recording_fps(path):
+    """The frame rate of a video file, or FRAMES_FPS for a directory of images.
+
+    Args:
+        path (str): a video file, or a directory of images
+
+    Returns:
+        float: frames per second
+    """
+    if os.path.isdir(path):
+        return FRAMES_FPS
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps if fps and fps > 0 else FRAMES_FPS
+
+
+def read_frames(path):
+    """The frames of a video file, such as an .mkv or .mp4, or of a directory of images in natural order.
+
+    Args:
+        path (str): a video file, or a directory of images
+
+    Yields:
+        np.ndarray: each frame, in BGR
+    """
+    if os.path.isdir(path):
+        paths = [name for name in glob.glob(os.path.join(path, "*")) if name.lower().endswith(IMAGE_EXTENSIONS)]
+        for name in sorted(paths, key=natural_key):
+            frame = cv2.imread(name)
+            if frame is not None:
+                yield frame
+        return
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"could not open {path}")
+    try:
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+def paced_frames(path, speed=1.0, fps=None, loop=False, stopping=None):
+    """The frames of a recording, each yielded when it is due.
+
+    Frames are scheduled from the start of the replay, so a slow consumer does not slow the replay down; late frames are yielded at once.
+
+    Args:
+        path (str): a video file, or a directory of images
+        speed (float, optional): how many times faster than recorded to play, e.g. 1.0 for realtime. None or 0 plays as fast as possible.
+        fps (float, optional): the recorded frame rate. Defaults to `recording_fps(path)`.
+        loop (bool, optional): whether to start over at the end
+        stopping (threading.Event, optional): ends the replay when set
+
+    Yields:
+        np.ndarray: each frame, in BGR
+    """
+    if stopping is None:
+        stopping = threading.Event()
+    interval = 1 / ((fps or recording_fps(path)) * speed) if speed else 0.0
+    start = time.monotonic()
+    index = 0
+    while not stopping.is_set():
+        played = 0
+        for frame in read_frames(path):
+            delay = start + index * interval - time.monotonic()
+            if delay > 0 and stopping.wait(delay):
+                return
+            if stopping.is_set():
+                return
+            yield frame
+            index += 1
+            played += 1
+        if not loop or played == 0:
+            return
+
+
+class ReplayVideo(FrameMailbox):
+    """A stand-in for direct_from_auv.Video that plays a recording instead of receiving the AUV's stream.
+
+    Frames are put in the mailbox by a thread of its own at the recorded rate, at `speed` times it, or as fast as possible, so anything written against Video, such as LaneRuntime, runs unchanged. Frames the consumer is too slow for are overwritten, like they are live, unless `lockstep` is set, which makes the replay wait for each frame to be taken so that every frame is processed.
+
+    Attributes:
+        path (str): the recording
+        speed (float): how many times faster than recorded it is played, or None for as fast as possible
+        fps (float): the recorded frame rate
+        finished (bool): whether the last frame was put in the mailbox
+        error (BaseException): what ended the replay early, if it failed
+    """
+
+    def __init__(self, path, speed=1.0, fps=None, loop=False, lockstep=False):
+        """Starts the replay.
+
+        Args:
+            path (str): a video file, such as an .mkv or .mp4, or a directory of images such as frames/
+            speed (float, optional): how many times faster than recorded to play, e.g. 1.0 for realtime. None or 0 plays as fast as possible.
+            fps (float, optional): the recorded frame rate. Defaults to the file's, or FRAMES_FPS for a directory.
+            loop (bool, optional): whether to start over at the end
+            lockstep (bool, optional): whether to wait for each frame to be taken before putting the next one
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        super().__init__()
+        self.path = path
+        self.speed = speed or None
+        self.fps = fps or recording_fps(path)
+        self.loop = loop
+        self.lockstep = lockstep
+        self.buffer_mode = "copy"
+        self.finished = False
+        self.error = None
+
+        self._stopping = threading.Event()
+        self._thread = None
+        self.run()
+
+    def run(self):
+        """Starts the replay thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._replay, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ends the replay."""
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _replay(self):
+        try:
+            for frame in paced_frames(self.path, self.speed, self.fps, self.loop, self._stopping):
+                if self.lockstep:
+                    with self._condition:
+                        self._condition.wait_for(lambda: self._new_frame is None or self._stopping.is_set())
+                self.put_frame(frame)
+        except BaseException as error:
+            self.error = error
+        self.finished = True
+
+
+def push_frames(path, host="127.0.0.1", port=5600, speed=1.0, fps=None, loop=False, stopping=None):
+    """Streams a recording as H.264 over RTP/UDP, the way the AUV does, so that direct_from_auv.Video can receive it on this machine. Needs OpenCV built with GStreamer.
+
+    Args:
+        path (str): a video file, or a directory of images. Frames are resized to the size of the first one.
+        host (str, optional): where to send the stream
+        port (int, optional): the UDP port, 5600 like the AUV
+        speed (float, optional): how many times faster than recorded to play. None or 0 plays as fast as possible.
+        fps (float, optional): the recorded frame rate. Defaults to the file's, or FRAMES_FPS for a directory.
+        loop (bool, optional): whether to start over at the end
+        stopping (threading.Event, optional): ends the stream when set
+
+    Returns:
+        int: the number of frames sent
+    """
+    fps = fps or recording_fps(path)
+    writer = None
+    size = None
+    sent = 0
+    try:
+        for frame in paced_frames(path, speed, fps, loop, stopping):
+            if writer is None:
+                size = (frame.shape[1], frame.shape[0])
+                pipeline = PUSH_PIPELINE.format(host=host, port=port, key_interval=int(round(fps)))
+                writer = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, fps, size, True)
+                if not writer.isOpened():
+                    raise RuntimeError("could not open the GStreamer pipeline; is OpenCV built with GStreamer?")
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            sent += 1
+    finally:
+        if writer is not None:
+            writer.release()
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded video as if it came from the AUV")
+    parser.add_argument("path", type=str, help="a video file such as an .mkv or .mp4, or a directory of images such as frames/")
+    parser.add_argument("--speed", type=float, default=1.0, help="how many times faster than recorded to play, 0 for as fast as possible")
+    parser.add_argument("--fps", type=float, default=None, help="the recorded frame rate")
+    parser.add_argument("--loop", action="store_true", help="start over at the end")
+    parser.add_argument("--push", action="store_true", help="stream over RTP/UDP for direct_from_auv.Video instead of playing in process")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="where to push the stream")
+    parser.add_argument("--port", type=int, default=5600, help="the UDP port to push the stream to")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    try:
+        if args.push:
+            sent = push_frames(args.path, args.host, args.port, args.speed, args.fps, args.loop)
+            print(f"Sent {sent} frames in {time.monotonic() - start:.1f} s")
+        else:
+            video = ReplayVideo(args.path, args.speed, args.fps, args.loop)
+            while not (video.finished and not video.frame_available()):
+                video.wait_frame(timeout=0.1)
+            if video.error is not None:
+                raise video.error
+            print(
+                f"{video.frame_count} frames in {time.monotonic() - start:.1f} s,"
+                f" {video.consumed_frames} taken, {video.overwritten_frames} overwritten"
+            )
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,149 @@
+from april_tags import *
+
+
+class TagTracker:
+    """Follows AprilTags from frame to frame, so that the detector only has to search the whole frame when a tag is lost.
+
+    The detector runs on padded crops around the corners of the tags found in the previous frame, and the tags it finds are moved back into full frame coordinates. Every `full_scan_every` frames, when no tags are being followed, or when a followed tag is missing from its crop, the whole frame is searched instead, which also picks up new tags.
+
+    Attributes:
+        tags (list): the tags found in the last frame
+        full_scans (int): the number of frames that were searched whole
+        roi_scans (int): the number of frames that were only searched in crops
+    """
+
+    def __init__(
+        self, pool=None, full_scan_every=30, padding=0.5, min_padding=32, scheduler=None, **config
+    ):
+        """Constructs a TagTracker.
+
+        Args:
+            pool (DetectorPool, optional): the pool to borrow Detectors from. Defaults to detector_pool.
+            full_scan_every (int, optional): the most frames in a row that are only searched in crops
+            padding (float, optional): how far to grow each crop past the tag corners, as a fraction of the tag size
+            min_padding (int, optional): the least padding around the tag corners, in pixels
+            scheduler (DetectorScheduler, optional): picks quad_decimate and nthreads for each frame, from the time each update takes
+            **config: Detector arguments that differ from DETECTOR_CONFIG
+        """
+        self.pool = pool if pool is not None else detector_pool
+        self.full_scan_every = full_scan_every
+        self.padding = padding
+        self.min_padding = min_padding
+        self.scheduler = scheduler
+        self.config = config
+        self.reset()
+
+    def reset(self):
+        """Forgets the tracked tags and resets the counters."""
+        self.tags = []
+        self.tracked_frames = 0
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def update(self, img) -> list:
+        """Finds the tags in a new frame, searching around the previous tags if possible.
+
+        Args:
+            img: the image, in grayscale
+
+        Returns:
+            list: the list of tags found in the image, in full frame coordinates
+        """
+        start = time.perf_counter()
+        config = self.config
+        if self.scheduler is not None:
+            config = {**config, **self.scheduler.settings()}
+
+        tags = None
+        if self.tags and self.tracked_frames < self.full_scan_every:
+            with latency.stage("track_tags") as timer:
+                tags = self.track(img, config)
+                timer.set_count(0 if tags is None else len(tags))
+            if tags is not None:
+                self.roi_scans += 1
+                self.tracked_frames += 1
+
+        if tags is None:
+            self.full_scans += 1
+            self.tracked_frames = 0
+            tags = get_tags(img, self.pool, **config)
+
+        self.tags = tags
+        if self.scheduler is not None:
+            self.scheduler.record(tags, time.perf_counter() - start)
+        return tags
+
+    def regions(self, shape) -> list[tuple[int, int, int, int]]:
+        """The padded boxes around the previous tags, with overlapping boxes merged.
+
+        Args:
+            shape (tuple): the shape of the image
+
+        Returns:
+            list[tuple[int, int, int, int]]: the boxes, each defined as (x1, y1, x2, y2) and clipped to the image
+        """
+        height, width = shape[:2]
+        boxes = []
+        for tag in self.tags:
+            (x1, y1), (x2, y2) = tag.corners.min(axis=0), tag.corners.max(axis=0)
+            pad = max(self.min_padding, self.padding * max(x2 - x1, y2 - y1))
+            boxes.append(
+                [
+                    max(0, int(x1 - pad)),
+                    max(0, int(y1 - pad)),
+                    min(width, int(np.ceil(x2 + pad))),
+                    min(height, int(np.ceil(y2 + pad))),
+                ]
+            )
+
+        # merge overlapping boxes until none overlap, so that no tag is found twice
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(box) for box in boxes]
+
+    def track(self, img, config=None) -> list:
+        """Looks for the previous tags in crops around them.
+
+        Args:
+            img: the image, in grayscale
+            config (dict, optional): the Detector arguments to use. Defaults to the ones the tracker was built with.
+
+        Returns:
+            list: the tags in full frame coordinates, or None if any previous tag was not found
+        """
+        if config is None:
+            config = self.config
+        fx, fy, cx, cy = CAMERA_PARAMS
+        tags = []
+        with self.pool.detector(**config) as at_detector:
+            for x1, y1, x2, y2 in self.regions(img.shape):
+                # shift the optical center too, so that the pose estimate is unchanged
+                found = at_detector.detect(
+                    img[y1:y2, x1:x2],
+                    True,
+                    camera_params=(fx, fy, cx - x1, cy - y1),
+                    tag_size=True,
+                )
+                offset = np.array([x1, y1], dtype=float)
+                shift = np.array([[1, 0, x1], [0, 1, y1], [0, 0, 1]], dtype=float)
+                for tag in found:
+                    tag.center = tag.center + offset
+                    tag.corners = tag.corners + offset
+                    tag.homography = shift @ tag.homography
+                tags.extend(found)
+
+        found_ids = {tag.tag_id for tag in tags}
+        if any(tag.tag_id not in found_ids for tag in self.tags):
+            return None
+        return tags
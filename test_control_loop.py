@@ -0,0 +1,58 @@
+import numpy as np
+
+from control_loop import *
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_first_fresh_tick_has_no_derivative_kick():
+    clock = FakeClock()
+    loop = ControlLoop(PIDBank(3, K_p=1.0, K_d=0.1, clock=clock), rate=50)
+
+    loop.measure([10, 0, 0])
+    np.testing.assert_allclose(loop.step(), [10, 0, 0])
+    clock.now += 0.02
+    np.testing.assert_allclose(loop.step(), [10, 0, 0])
+
+
+def test_recovery_from_stale_measurements_starts_from_the_fresh_errors():
+    clock = FakeClock()
+    loop = ControlLoop(PIDBank(3, K_p=1.0, K_d=0.1, clock=clock), rate=50, stale_after=0.5)
+
+    loop.measure([10, 0, 0])
+    loop.step()
+    clock.now = 5.0
+    loop.step()
+    assert loop.stale
+
+    loop.measure([4, 0, 0])
+    np.testing.assert_allclose(loop.step(), [4, 0, 0])
+    assert not loop.stale
+
+
+def test_step_errors_are_not_extrapolated_by_default():
+    clock = FakeClock()
+    loop = ControlLoop(PIDBank(3, K_p=1.0, clock=clock), rate=50)
+
+    # longitudinal jumps from 0 to 100 and lateral from -20 to 30 between frames 33 ms apart, measured 40 ms late
+    loop.measure([0, -20, 0], timestamp=0.0)
+    loop.measure([100, 30, 0], timestamp=0.033)
+    clock.now = 0.073
+    np.testing.assert_allclose(loop.step(), [100, 30, 0])
+
+
+def test_extrapolation_follows_continuous_errors_when_enabled():
+    clock = FakeClock()
+    loop = ControlLoop(PIDBank(3, K_p=1.0, clock=clock), rate=50, max_extrapolation=0.2)
+
+    # each error grows by 1 every 10 ms, and the measurement is 20 ms old
+    loop.measure([0, 0, 0], timestamp=0.0)
+    loop.measure([1, 2, 3], timestamp=0.01)
+    clock.now = 0.03
+    np.testing.assert_allclose(loop.step(), [3, 6, 9])
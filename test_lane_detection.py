@@ -0,0 +1,87 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from lane_detection import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FRAMES = sorted(glob.glob(os.path.join(HERE, "frames", "*.jpg")))
+IMAGES = FRAMES + [os.path.join(HERE, name) for name in ("frame_from_auv.jpg", "rov_pool.jpg", "lights_test.jpg")]
+# how far each approximate blur may be from the exact Gaussian: the largest and the mean difference
+# in gray levels, and the fraction of black and white pixels that may change
+BLUR_TOLERANCES = {
+    "box": {"max": 4, "mean": 0.2, "bw": 0.001},
+    "pyramid": {"max": 23, "mean": 1.0, "bw": 0.006},
+}
+
+
+def frame_lines(path):
+    """The line segments the lane pipeline finds in a bundled frame, and the height of the sliced frame."""
+    sliced = split(cv2.imread(path))
+    edges = find_edges(to_bw(to_blurred(to_gray(sliced))))
+    return find_lines(edges), sliced.shape[0]
+
+
+def assert_same_groups(expected, actual):
+    assert list(expected) == list(actual)
+    for label in expected:
+        assert list(expected[label]) == list(actual[label])
+        for x_label in expected[label]:
+            np.testing.assert_array_equal(expected[label][x_label].points, actual[label][x_label].points)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_group_lines_sort_matches_dbscan_on_random_lines(seed):
+    rng = np.random.default_rng(seed)
+    height = 540
+    points = rng.integers(0, [1920, height, 1920, height], size=(rng.integers(2, 200), 4))
+    lines = LineSet(points, image_height=height)
+
+    assert_same_groups(
+        group_lines(lines, height, method="dbscan"),
+        group_lines(lines, height, method="sort"),
+    )
+
+
+@pytest.mark.parametrize("path", FRAMES, ids=os.path.basename)
+def test_group_lines_sort_matches_dbscan_on_frames(path):
+    lines, height = frame_lines(path)
+    if len(lines) < 1:
+        pytest.skip("no lines in this frame")
+
+    assert_same_groups(
+        group_lines(lines, height, method="dbscan"),
+        group_lines(lines, height, method="sort"),
+    )
+
+
+def test_merge_line_groups_horizontal():
+    height, width = 540, 1920
+    # one exactly horizontal group, whose least squares slope is only rounding error, and one sloped group
+    points = np.array([[866, 109, 1035, 109], [100, 540, 300, 0]])
+    merged = merge_line_groups(points, np.array([0, 1]), height, width)
+
+    np.testing.assert_allclose(merged[0], [width, 109, 0, 109])
+    assert Line(*merged[0], image_height=height).x_intercept == NO_X_INTERCEPT
+    np.testing.assert_allclose(merged[1], [100, 540, 300, 0])
+
+
+@pytest.mark.parametrize("blur", BLUR_TOLERANCES)
+@pytest.mark.parametrize("path", IMAGES, ids=os.path.basename)
+def test_preprocessor_blur_within_tolerance_of_gaussian(path, blur):
+    frame = cv2.imread(path)
+    exact = Preprocessor()
+    approximate = Preprocessor(blur=blur)
+    exact_bw = exact(frame)[0].copy()
+    approximate_bw = approximate(frame)[0]
+    tolerance = BLUR_TOLERANCES[blur]
+
+    # the exact Preprocessor is the 19x19 Gaussian of to_blurred
+    np.testing.assert_array_equal(exact.blurred, to_blurred(to_gray(split(frame))))
+    difference = np.abs(approximate.blurred.astype(int) - exact.blurred.astype(int))
+    assert difference.max() <= tolerance["max"]
+    assert difference.mean() <= tolerance["mean"]
+    assert np.mean(approximate_bw != exact_bw) <= tolerance["bw"]
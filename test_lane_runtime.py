@@ -0,0 +1,30 @@
+import os
+
+import lane_runtime
+from lane_runtime import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_low_resolution_level_detects_at_the_low_scale(monkeypatch):
+    scales = []
+    levels = []
+
+    def recording_errors_from_frame(frame, preprocessor, tracker=None):
+        scales.append(preprocessor.scale)
+        if tracker is not None:
+            assert tracker.preprocessor is preprocessor
+        levels.append(runtime.shedder.level_name)
+        return errors_from_frame(frame, preprocessor, tracker=tracker)
+
+    monkeypatch.setattr(lane_runtime, "errors_from_frame", recording_errors_from_frame)
+    # every frame misses a deadline this short, so the level goes up after every frame
+    shedder = LoadShedder(1e-9, RUNTIME_LEVELS, degrade_after=1)
+    source = ReplayVideo(os.path.join(HERE, "frames"), speed=0, lockstep=True)
+    runtime = LaneRuntime(source, sink=lambda outputs, timestamp: None, scale=0.5, shedder=shedder)
+    run(runtime, report_every=60)
+
+    assert runtime.processed_frames == 37
+    assert scales[levels.index("full")] == 0.5
+    assert scales[levels.index("low_resolution")] == 0.5 * shedder.low_scale
+    assert scales[levels.index("tracker_only")] == 0.5 * shedder.low_scale
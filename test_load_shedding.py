@@ -0,0 +1,31 @@
+from load_shedding import *
+
+
+def run(shedder, frame_cost, frames):
+    """Offers frames that take `frame_cost(shedder)` seconds each, and returns the level after each one."""
+    levels = []
+    for _ in range(frames):
+        if shedder.should_process():
+            shedder.record(frame_cost(shedder))
+        levels.append(shedder.level_name)
+    return levels
+
+
+def cost(full_seconds):
+    # frames cost a quarter as much at half resolution
+    return lambda shedder: full_seconds / 4 if shedder.at_least("low_resolution") else full_seconds
+
+
+def test_skipping_frames_does_not_hide_slow_frames():
+    shedder = LoadShedder(deadline=0.033)
+    levels = run(shedder, cost(0.050), 500)
+
+    assert levels[-1] == "low_resolution"
+    assert levels.count("skip_frames") < 50
+
+
+def test_recovers_when_load_falls():
+    shedder = LoadShedder(deadline=0.033, levels=("full", "low_resolution", "tracker_only"))
+    assert run(shedder, cost(0.050), 500)[-1] == "low_resolution"
+
+    assert run(shedder, cost(0.010), 1000)[-1] == "full"
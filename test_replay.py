@@ -0,0 +1,21 @@
+import os
+import time
+
+from replay import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_lockstep_replay_waits_for_a_slow_consumer():
+    video = ReplayVideo(os.path.join(HERE, "frames"), speed=0, lockstep=True)
+    deadline = time.monotonic() + 30
+    while not (video.finished and not video.frame_available()):
+        assert time.monotonic() < deadline, "the replay stalled"
+        if video.wait_frame(timeout=0.1) is not None:
+            # slower than decoding a frame
+            time.sleep(0.02)
+    video.stop()
+
+    assert video.error is None
+    assert video.frame_count == video.consumed_frames == 37
+    assert video.overwritten_frames == 0
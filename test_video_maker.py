@@ -0,0 +1,42 @@
+import glob
+import os
+import re
+
+import cv2
+
+from video_maker import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_video(path, fps):
+    """Writes the bundled frames of the standard size as a video."""
+    frames = [cv2.imread(name) for name in sorted(glob.glob(os.path.join(HERE, "frames", "frame*.jpg")))]
+    height, width = frames[0].shape[:2]
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame in frames:
+        out.write(cv2.resize(frame, (width, height)))
+    out.release()
+    return len(frames)
+
+
+def test_realtime_render_sheds_load(tmp_path, capsys):
+    # no frame can be rendered in the interval of a 1000 frames/sec video
+    input = str(tmp_path / "input.mp4")
+    count = write_video(input, fps=1000)
+    render_video(input, str(tmp_path / "output.mp4"), workers=1, realtime=True)
+
+    output = capsys.readouterr().out
+    match = re.search(r"(\d+) frames skipped, workers ended at (\w+)", output)
+    assert match is not None
+    assert 0 < int(match.group(1)) < count
+    assert match.group(2) == "no_drawing"
+    assert cv2.VideoCapture(str(tmp_path / "output.mp4")).get(cv2.CAP_PROP_FRAME_COUNT) == count
+
+
+def test_render_without_realtime_sheds_nothing(tmp_path, capsys):
+    input = str(tmp_path / "input.mp4")
+    write_video(input, fps=1000)
+    render_video(input, str(tmp_path / "output.mp4"), workers=1)
+
+    assert "skipped" not in capsys.readouterr().out
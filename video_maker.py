@@ -1,75 +1,239 @@
-from multiprocessing import Process
+import argparse
+import os
+import queue
+import threading
+import time
+from multiprocessing import Process, Queue
 
-from lane_detection import *
-from lane_following import *
+from frame_ring import FrameRing
+from lane_pipeline import *
+from lane_tracking import *
+from load_shedding import *
 
+# CONSTANTS
+# the workers render frames out of order, so there is no lane to track between them
+RENDER_LEVELS = ("full", "skip_frames", "low_resolution", "no_drawing")
 
-def render_frame(frame):
+
+def render_frame(
+    frame,
+    preprocessor: Preprocessor = None,
+    scale: float = 1.0,
+    tracker: LaneTracker = None,
+    draw: bool = True,
+):
     """Applies a sequence of image filtering and processing to find the center lane of a frame. Outputs the frame with the center lane drawn and a text overlay suggesting which direction to move/turn.
     
     ### Parameters
         frame: the frame to process/render
+        preprocessor (Preprocessor, optional): the preprocessor to filter the frame with. Defaults to the shared one for `scale`, which is not thread safe.
+        scale (float, optional): the scale to detect lanes at when no preprocessor is given, e.g. 0.5 for half resolution. Defaults to 1.0.
+        tracker (LaneTracker, optional): if given, the lane is tracked from the previous frame instead of detected from scratch. The tracker's own preprocessor is used for full detections. Defaults to None.
+        draw (bool, optional): whether to draw the center line and the text, e.g. False while a LoadShedder sheds drawing. Defaults to True.
 
     ### Returns
         image: the post-processed image.
     """
-    # Process image
-    sliced = split(frame)
-    height = sliced.shape[0]
-    width = sliced.shape[1]
-    gray = to_gray(sliced)
-    blurred = to_blurred(gray)
-    bw = to_bw(blurred)
-
-    # Edge/line detection
-    edges = find_edges(bw)
-    lines = find_lines(edges)
-    if len(lines) > 1:
-        grouped_lines = group_lines(lines, height, slope_tolerance=0.1, x_intercept_tolerance=50) # group lines
-        merged_lines = merge_lines(grouped_lines, height, width) # merge groups of lines
-
-        # Lane Detection
-        lanes = detect_lanes(bw, merged_lines, 500, 200, 10)
-
-        # Lane picking
-        center_lines = merge_lane_lines(lanes, height) # find the center of each lane
-        center_line = pick_center_line(center_lines, width) # find the closest lane
-        (longitudinal, lateral, turn) = error_from_line(center_line, width) # textual suggestion of how to move
-        # print(f"{longitudinal = }, {lateral = }, {turn = }")
-        turn = np.rad2deg(turn)
-        if longitudinal == 100:
-            text = f"Move forward: {longitudinal:.2f} | Turn: {turn:.2f}"
-        elif lateral != 0:
-            text = f"Move lateral: {lateral:.2f}% | Turn: {turn:.2f}"
+    if preprocessor is None:
+        preprocessor = shared_preprocessor(scale)
+    width = frame.shape[1]
+
+    with latency.frame():
+        # Process image, edge/line detection and lane picking
+        if tracker is not None:
+            found = tracker.update(frame)
         else:
-            text = f"Don't move"
+            found = find_center_line(frame, preprocessor)
+        if found is not None and draw:
+            center_line, lanes = found
+            with latency.stage("error_from_line"):
+                (longitudinal, lateral, turn) = error_from_line(center_line, width) # textual suggestion of how to move
+            # print(f"{longitudinal = }, {lateral = }, {turn = }")
+            turn = np.rad2deg(turn)
+            if longitudinal == 100:
+                text = f"Move forward: {longitudinal:.2f} | Turn: {turn:.2f}"
+            elif lateral != 0:
+                text = f"Move lateral: {lateral:.2f}% | Turn: {turn:.2f}"
+            else:
+                text = f"Don't move"
 
-        # Drawing
-        # frame = draw_lanes(frame, lanes, offset=True)
-        frame = draw_lines(frame, [center_line], (0, 0, 255), offset=True)
-        frame = cv2.putText(frame, text, (0, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (255,255,255), 2, cv2.LINE_AA)
+            # Drawing
+            with latency.stage("draw"):
+                # frame = draw_lanes(frame, lanes, offset=True)
+                frame = draw_lines(frame, [center_line], (0, 0, 255), offset=True)
+                frame = cv2.putText(frame, text, (0, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (255,255,255), 2, cv2.LINE_AA)
     return frame
 
-if __name__ == "__main__":
-    cap = cv2.VideoCapture('AUV_Vid.mkv')
-    ret, frame1 = cap.read()
-    height, width, layers = frame1.shape
-    size = (width, height)
-    out = cv2.VideoWriter("rendered_video.mp4", cv2.VideoWriter_fourcc(*'mp4v'), 30, size)
-
-    count = 0 # the number of frames since the last    
-    while ret:
-        ret, frame = cap.read()
+def render_worker(ring: FrameRing, tasks: Queue, results: Queue, scale: float = 1.0, deadline: float = None):
+    """The loop run by each worker process of `render_video`. Renders (index, slot) tasks in place in `ring` until it receives None.
+
+    ### Parameters
+        ring (FrameRing): the shared memory holding the frames
+        tasks (Queue): the frames to render, as (index, slot)
+        results (Queue): where the rendered (index, slot) are put, followed by (None, report) when done, where report is the LoadShedder report or None
+        scale (float, optional): passed to `render_frame`. Defaults to 1.0.
+        deadline (float, optional): if given, the time each frame may take, in seconds. Load is shed with a LoadShedder while frames take longer: frames are skipped and left as they are, detected at a lower scale, or not drawn on. Defaults to None, which renders every frame in full.
+    """
+    shedder = None
+    if deadline is not None:
+        shedder = LoadShedder(deadline, RENDER_LEVELS)
+        preprocessor = Preprocessor(scale=scale)
+        low_preprocessor = Preprocessor(scale=scale * shedder.low_scale)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, slot = task
+        frame = ring[slot]
+        if shedder is None:
+            rendered = render_frame(frame, scale=scale)
+        elif shedder.should_process():
+            start = time.perf_counter()
+            rendered = render_frame(
+                frame,
+                low_preprocessor if shedder.at_least("low_resolution") else preprocessor,
+                draw=shedder.draw,
+            )
+            shedder.record(time.perf_counter() - start)
+        else:
+            rendered = frame
+        if rendered is not frame:
+            frame[...] = rendered
+        results.put((index, slot))
+    results.put((None, shedder.report() if shedder is not None else None))
+    ring.close()
+
+
+def read_frames(cap, ring: FrameRing, tasks: Queue, workers: int, index: int = 0):
+    """Decodes every remaining frame of `cap` straight into free slots of `ring`, queues them as (index, slot), then tells each of the `workers` to stop.
+
+    ### Parameters
+        cap (cv2.VideoCapture): the video to read
+        ring (FrameRing): the shared memory to decode into, which blocks when every slot is in use
+        tasks (Queue): the queue of frames to render
+        workers (int): the number of workers reading from `tasks`
+        index (int, optional): the index of the next frame. Defaults to 0.
+    """
+    while True:
+        slot = ring.acquire()
+        view = ring[slot]
+        ret, frame = cap.read(view)
         if not ret:
+            ring.release(slot)
             break
+        if not np.shares_memory(frame, view):
+            view[...] = frame
+        tasks.put((index, slot))
+        index += 1
+    for _ in range(workers):
+        tasks.put(None)
+
 
-        print(f"now on frame {count}...")
-        frame = render_frame(frame)
-            
-        out.write(frame)
+def render_video(
+    input: str,
+    output: str,
+    workers: int = None,
+    scale: float = 1.0,
+    report_every: int = 100,
+    realtime: bool = False,
+) -> float:
+    """Renders every frame of a video with `render_frame`, using a pool of worker processes. Frames are decoded on one thread into a shared memory `FrameRing`, rendered in place by the workers, and written back in their original order. Only slot numbers go through the queues.
 
-        count += 1
+    ### Parameters
+        input (str): the path of the video to render
+        output (str): the path to write the rendered video to
+        workers (int, optional): the number of worker processes. Defaults to the number of CPUs.
+        scale (float, optional): passed to `render_frame`. Defaults to 1.0.
+        report_every (int, optional): how often, in frames, to print the frame rate. Defaults to 100.
+        realtime (bool, optional): whether to keep up with the video's frame rate by shedding load in each worker, see `render_worker`. Defaults to False, which renders every frame in full.
+
+    ### Returns
+        float: the average number of frames rendered per second
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    cap = cv2.VideoCapture(input)
+    ret, first = cap.read()
+    if not ret:
+        raise ValueError(f"could not read a frame from {input}")
+    height, width = first.shape[:2]
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    out = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    # the ring bounds how far decoding can run ahead of writing
+    ring = FrameRing(4 * workers, first.shape, first.dtype)
+    tasks = Queue()
+    results = Queue()
+    slot = ring.acquire()
+    ring[slot][...] = first
+    tasks.put((0, slot))
+
+    # each worker renders one frame in `workers`, so it has that many frame intervals per frame
+    deadline = workers / fps if realtime else None
+    processes = [
+        Process(target=render_worker, args=(ring, tasks, results, scale, deadline), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    reader = threading.Thread(target=read_frames, args=(cap, ring, tasks, workers, 1), daemon=True)
+    reader.start()
+
+    start = time.perf_counter()
+    pending = {}  # slots of rendered frames that arrived before the frames ahead of them
+    written = 0
+    finished = 0
+    reports = []  # the LoadShedder report of each worker
+    try:
+        while finished < workers:
+            try:
+                index, slot = results.get(timeout=1)
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    raise RuntimeError("a render worker died, see its traceback above")
+                continue
+            if index is None:
+                # the slot of a finished worker's last message is its report
+                finished += 1
+                if slot is not None:
+                    reports.append(slot)
+                continue
+
+            pending[index] = slot
+            while written in pending:
+                slot = pending.pop(written)
+                out.write(ring[slot])
+                ring.release(slot)
+                written += 1
+                if written % report_every == 0:
+                    print(f"rendered {written} frames, {written / (time.perf_counter() - start):.1f} frames/sec")
+
+        reader.join()
+        for process in processes:
+            process.join()
+    finally:
+        cap.release()
+        out.release()
+        ring.close()
+        ring.unlink()
+
+    frames_per_second = written / (time.perf_counter() - start)
+    print(f"Finished rendering the video: {written} frames, {frames_per_second:.1f} frames/sec.")
+    if reports:
+        skipped = sum(report["skipped_frames"] for report in reports)
+        levels = ", ".join(report["level_name"] for report in reports)
+        print(f"Shed load to keep up with {fps:.0f} frames/sec: {skipped} frames skipped, workers ended at {levels}.")
+    return frames_per_second
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the lane suggestions onto a video")
+    parser.add_argument("--input", type=str, default="AUV_Vid.mkv", help="the video to render")
+    parser.add_argument("--output", type=str, default="rendered_video.mp4", help="where to write the rendered video")
+    parser.add_argument("--workers", type=int, default=None, help="the number of worker processes, defaults to the number of CPUs")
+    parser.add_argument("--scale", type=float, default=1.0, help="the scale to detect lanes at")
+    parser.add_argument("--realtime", action="store_true", help="shed load to keep up with the video's frame rate")
+    args = parser.parse_args()
 
-    cap.release()
-    out.release()
-    print("Finished rendering the video.")
\ No newline at end of file
+    render_video(args.input, args.output, workers=args.workers, scale=args.scale, realtime=args.realtime)